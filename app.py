@@ -1,12 +1,25 @@
+import time
+t_script = time.perf_counter()  # importを含めて計測 (プロセス最初の実行ならコールドスタート)
 import streamlit as st
-import neal
-from pyqubo import Array, Constraint, LogEncInteger
 import plotly.graph_objects as go
+import plotly.io
+import collections
+import itertools
+import logging
 import os
+import sys
+import threading
 import urllib.parse
+import numpy as np
+from catalog import DEFAULT_CATALOG, load_catalogs
+from engine import resource_keys, enumerable, LIMIT_MAX, ANNEALING_SOLVERS, DIVERSE_CATEGORIES, QUBO_ENCODINGS, SOLVER_LABELS, calculate_details, get_order_index, solve_group, sweep_chain
+from jobs import SolverBusy, get_solve_queue
+from metrics import get_metrics
+from result_cache import get_result_cache
 
 # --- ページ設定 ---
 st.set_page_config(page_title="Jiro Order Optimizer", layout="wide")
+DEBUG = st.query_params.get("debug") == "1"
 
 # --- CSS定義 (デザイン一元管理) ---
 st.markdown("""
@@ -81,76 +94,9 @@ button[kind="primary"]:hover {
 </style>
 """, unsafe_allow_html=True)
 
-# --- データ定義 ---
-items_data = {
-    # 麺
-    "麺通常(300g)":   {"cal": 1000, "sodium": 6.0, "satisfaction": 150, "price": 700, "cat": "noodle"},
-    "麺少なめ(200g)": {"cal": 700,  "sodium": 5.0, "satisfaction": 100, "price": 700, "cat": "noodle"},
-    "麺半分(150g)":   {"cal": 550,  "sodium": 4.5, "satisfaction": 80,  "price": 700, "cat": "noodle"},
-    # 豚
-    "豚(2枚・標準)":  {"cal": 0,    "sodium": 0.0, "satisfaction": 50,  "price": 0,   "cat": "pork"},
-    "豚増し(5枚)":    {"cal": 500,  "sodium": 3.5, "satisfaction": 100, "price": 150, "cat": "pork"},
-    "豚ダブル(8枚)":  {"cal": 1000, "sodium": 7.0, "satisfaction": 160, "price": 250, "cat": "pork"},
-    # ヤサイ
-    "ヤサイ少なめ":   {"cal": 20,   "sodium": 0.0, "satisfaction": 20,  "price": 0,   "cat": "vege"},
-    "ヤサイ普通":     {"cal": 40,   "sodium": 0.0, "satisfaction": 40,  "price": 0,   "cat": "vege"},
-    "ヤサイマシ":     {"cal": 60,   "sodium": 0.0, "satisfaction": 60,  "price": 0,   "cat": "vege"},
-    "ヤサイマシマシ": {"cal": 100,  "sodium": 0.0, "satisfaction": 90,  "price": 0,   "cat": "vege"},
-    # アブラ
-    "アブラ無し":     {"cal": 0,    "sodium": 0.0, "satisfaction": 0,   "price": 0,   "cat": "fat"},
-    "アブラ普通":     {"cal": 100,  "sodium": 0.2, "satisfaction": 30,  "price": 0,   "cat": "fat"},
-    "アブラマシ":     {"cal": 270,  "sodium": 0.5, "satisfaction": 70,  "price": 0,   "cat": "fat"},
-    "アブラマシマシ": {"cal": 500,  "sodium": 1.0, "satisfaction": 100, "price": 0,   "cat": "fat"},
-    # ニンニク
-    "ニンニク無し":   {"cal": 0,    "sodium": 0.0, "satisfaction": 0,   "price": 0,   "cat": "garlic"},
-    "ニンニク少なめ": {"cal": 5,    "sodium": 0.0, "satisfaction": 20,  "price": 0,   "cat": "garlic"},
-    "ニンニク普通":   {"cal": 20,   "sodium": 0.0, "satisfaction": 50,  "price": 0,   "cat": "garlic"},
-    "ニンニク増し":   {"cal": 40,   "sodium": 0.0, "satisfaction": 80,  "price": 0,   "cat": "garlic"},
-    # オプション
-    "★スープ完飲(K.K.)": {"cal": 600, "sodium": 8.0, "satisfaction": 120, "price": 0, "cat": "soup_option"},
-    "生卵":              {"cal": 80,   "sodium": 0.0, "satisfaction": 20,  "price": 50,  "cat": "topping"},
-    "うずら(5個)":       {"cal": 100,  "sodium": 0.5, "satisfaction": 30,  "price": 150, "cat": "topping"},
-}
-
-item_names = list(items_data.keys())
-num_items = len(item_names)
-target_categories = ["noodle", "pork", "vege", "fat", "garlic"]
-
-high_carb_items = ["麺通常(300g)"]
-high_fat_items = ["アブラマシ", "アブラマシマシ"]
-low_carb_items = ["麺半分(150g)"] 
-volumey_vege = ["ヤサイマシ", "ヤサイマシマシ"]
-
-# --- 関数群 ---
-
-def calculate_details(selected_items, weights):
-    total_cal = sum(items_data[n]["cal"] for n in selected_items)
-    total_sodium = sum(items_data[n]["sodium"] for n in selected_items)
-    total_price = sum(items_data[n]["price"] for n in selected_items)
-    
-    weighted_satisfaction = 0
-    for n in selected_items:
-        cat = items_data[n]["cat"]
-        w = weights.get(cat, 1.0)
-        if cat in ["soup_option", "topping"]: w = weights.get("topping", 1.0)
-        weighted_satisfaction += items_data[n]["satisfaction"] * w
-    
-    randle_penalty = 0
-    diet_bonus = 0
-    
-    if any(i in selected_items for i in high_carb_items) and any(i in selected_items for i in high_fat_items):
-        randle_penalty = 50
-    if any(i in selected_items for i in low_carb_items) and any(i in selected_items for i in volumey_vege):
-        diet_bonus = 30 
-
-    final_score = weighted_satisfaction + diet_bonus - randle_penalty
-    
-    return {
-        "cal": total_cal, "sodium": total_sodium, "price": total_price,
-        "base_sat": weighted_satisfaction, "randle_penalty": randle_penalty,
-        "diet_bonus": diet_bonus, "final_score": final_score
-    }
-
+# 結果タブの図は数値入力だけで決まるので、再実行をまたいでメモ化する (同じプランなら図を作り直さない)
+# 戻り値は (図, JSONバイト数)。バイト数は描画計測用
+@st.cache_resource(max_entries=256, show_spinner=False)
 def create_gauge(value, user_limit, title, suffix, mode="standard"):
     bar_color = "#1f77b4"
     steps = []
@@ -197,9 +143,16 @@ def create_gauge(value, user_limit, title, suffix, mode="standard"):
         }
     ))
     fig.update_layout(height=160, width=220, margin=dict(l=20,r=20,t=30,b=10), paper_bgcolor='rgba(0,0,0,0)')
-    return fig
+    return fig, len(plotly.io.to_json(fig, validate=False))
+
+RADAR_KEYS = ['cal', 'sodium', 'price', 'final_score']
 
 def draw_radar_chart(opt_stats, user_stats, limits):
+    return radar_chart(tuple(opt_stats[k] for k in RADAR_KEYS), tuple(user_stats[k] for k in RADAR_KEYS) if user_stats else None, tuple(limits[k] for k in RADAR_KEYS[:3]))
+
+@st.cache_resource(max_entries=256, show_spinner=False)
+def radar_chart(opt, user, lim):
+    opt_stats, user_stats, limits = dict(zip(RADAR_KEYS, opt)), dict(zip(RADAR_KEYS, user)) if user else None, dict(zip(RADAR_KEYS, lim))
     categories = ['カロリー', '塩分', '価格', '満足度(Score)']
     base_score = max(opt_stats['final_score'], user_stats.get('final_score', 1) if user_stats else 1) * 1.2
     
@@ -228,33 +181,110 @@ def draw_radar_chart(opt_stats, user_stats, limits):
         legend=dict(x=1, y=1, xanchor="right", yanchor="top", font=dict(size=14, color="black"), bgcolor="rgba(255,255,255,0.8)", bordercolor="#ccc", borderwidth=1),
         margin=dict(l=40, r=40, t=20, b=20), height=350, paper_bgcolor='rgba(0,0,0,0)',
     )
+    fig = go.Figure(data=data, layout=layout)
+    return fig, len(plotly.io.to_json(fig, validate=False))
+
+STOP_REASON_LABELS = {"converged": "上位プランが収束", "time_budget": "時間予算に到達", "max_reads": "読み出し上限", "cancelled": "キャンセル"}
+RESOURCE_LABELS = {"cal": "カロリー (kcal)", "sodium": "塩分 (g)", "price": "価格 (円)"}
+
+PREVIEW_POINTS = 2000
+
+def draw_pareto_chart(index, weights, resource, limits):
+    # 横軸以外のリミットを満たすオーダーだけで、満足度 vs リソースのフロンティアを描く
+    others = {k: v for k, v in limits.items() if k != resource}
+    cand = index.within(others)
+    front = index.pareto_front(weights, resource, cand)
+    score = index.scores(weights)
+    col = resource_keys.index(resource)
+    scale = 0.1 if resource == "sodium" else 1
+    # 背景の点は間引いて送る (フロンティアは全点)
+    shown = np.random.default_rng(0).choice(cand, PREVIEW_POINTS, replace=False) if len(cand) > PREVIEW_POINTS else cand
+
+    data = [
+        go.Scatter(x=index.resources[shown, col] * scale, y=score[shown], mode='markers', name='オーダー', marker=dict(size=4, color='rgba(150,150,150,0.35)'), hoverinfo='skip'),
+        go.Scatter(x=index.resources[front, col] * scale, y=score[front], mode='lines+markers', name='フロンティア', line=dict(color='#F4D03F', shape='hv', width=3)),
+    ]
+    layout = go.Layout(
+        xaxis=dict(title=RESOURCE_LABELS[resource]), yaxis=dict(title='満足度スコア'),
+        shapes=[dict(type='line', x0=limits[resource], x1=limits[resource], yref='paper', y0=0, y1=1, line=dict(color='red', dash='dot'))],
+        legend=dict(x=0, y=1), margin=dict(l=40, r=20, t=20, b=40), height=320, paper_bgcolor='rgba(0,0,0,0)',
+    )
     return go.Figure(data=data, layout=layout)
 
+def draw_sweep_heatmap(z, budgets, cal_limits, colorbar_title, text_fmt, colorscale):
+    text = [[text_fmt.format(v) if v == v else "-" for v in row] for row in z]
+    fig = go.Figure(go.Heatmap(z=z, x=budgets, y=cal_limits, text=text, texttemplate="%{text}", colorscale=colorscale, colorbar=dict(title=colorbar_title)))
+    fig.update_layout(xaxis=dict(title="予算 (円)", type="category"), yaxis=dict(title="カロリー上限 (kcal)", type="category"),
+                      margin=dict(l=40, r=20, t=20, b=40), height=320, paper_bgcolor='rgba(0,0,0,0)')
+    return fig
+
+def ticket_html(items, catalog):
+    tags_html = '<div class="ticket-container">'
+    for item in items:
+        cat = catalog.item_cat(item)
+        cat_class = f"ticket-{cat}" if cat in ["noodle", "pork", "vege", "fat", "garlic", "topping", "soup_option"] else "ticket-topping"
+        tags_html += f'<div class="ticket {cat_class}">{item}</div>'
+    tags_html += '</div>'
+    return tags_html
+
 # --- UI レイアウト開始 ---
 
 # ヘッダー画像
 img_file = "jiro2.jpg"  # 保存したファイル名 (適宜変更してください)
-if os.path.exists(img_file):
+
+@st.cache_resource(show_spinner=False)
+def load_header_image(path):
+    # 画像はプロセスで1回だけ読む (無ければ None)
+    if not os.path.exists(path): return None
+    with open(path, "rb") as f: return f.read()
+
+header_image = load_header_image(img_file)
+if header_image is not None:
     col_left_margin, col_img, col_right_margin = st.columns([1, 1, 1])
-    with col_img: st.image(img_file, use_container_width=True)
+    with col_img: st.image(header_image, use_container_width=True)
     st.write("")
 else:
     st.title("🍜 Jiro Order Optimizer")
 
+# 店舗カタログ: 環境変数 JIRO_CATALOG か catalog.csv があれば店舗を選べる (無ければ標準メニュー)
+catalog_path = os.environ.get("JIRO_CATALOG", "catalog.csv")
+catalogs = load_catalogs(catalog_path) if os.path.exists(catalog_path) else {DEFAULT_CATALOG.shop_id: DEFAULT_CATALOG}
+
 # サイドバー: 比較設定
 with st.sidebar:
+    if len(catalogs) > 1:
+        st.header("🏪 店舗")
+        catalog = catalogs[st.selectbox("店舗", list(catalogs))]
+        st.caption(f"{catalog.num_items}品目 / 全{catalog.order_count():,}オーダー")
+    else:
+        catalog = next(iter(catalogs.values()))
+
     st.header("🛠️ 比較設定")
     enable_comparison = st.checkbox("「いつものオーダー」と比較", value=True)
     user_selection = []
     if enable_comparison:
         st.caption("普段頼んでいる内容を入力してください")
-        u_noodle_sel = st.selectbox("いつもの麺", [k for k,v in items_data.items() if v['cat']=='noodle'])
-        u_vege_sel = st.selectbox("いつものヤサイ", [k for k,v in items_data.items() if v['cat']=='vege'], index=1)
-        u_garlic_sel = st.selectbox("いつものニンニク", [k for k,v in items_data.items() if v['cat']=='garlic'], index=2)
-        u_pork_sel = st.selectbox("いつもの豚", [k for k,v in items_data.items() if v['cat']=='pork'])
-        u_fat_sel = st.selectbox("いつものアブラ", [k for k,v in items_data.items() if v['cat']=='fat'], index=1)
-        u_opts_sel = st.multiselect("いつものOP", [k for k,v in items_data.items() if v['cat'] in ['soup_option','topping']])
-        user_selection = [u_noodle_sel, u_pork_sel, u_vege_sel, u_fat_sel, u_garlic_sel] + u_opts_sel
+        def usual_select(label, cat, index=0):
+            options = catalog.items_in(cat)
+            return st.selectbox(label, options, index=min(index, len(options) - 1)) if options else None
+        u_noodle_sel = usual_select("いつもの麺", "noodle")
+        u_vege_sel = usual_select("いつものヤサイ", "vege", 1)
+        u_garlic_sel = usual_select("いつものニンニク", "garlic", 2)
+        u_pork_sel = usual_select("いつもの豚", "pork")
+        u_fat_sel = usual_select("いつものアブラ", "fat", 1)
+        u_opts_sel = st.multiselect("いつものOP", catalog.items_in("soup_option", "topping"))
+        user_selection = [n for n in [u_noodle_sel, u_pork_sel, u_vege_sel, u_fat_sel, u_garlic_sel] if n] + u_opts_sel
+
+    st.header("⚙️ ソルバー設定")
+    # 全列挙できないほど大きい店舗では厳密解を出さない
+    exact_ok = enumerable(catalog)
+    solver_mode = st.radio("計算エンジン", [k for k in SOLVER_LABELS if exact_ok or k != "exact"], format_func=SOLVER_LABELS.get,
+                           help="厳密解: 全オーダーを一括評価 / 分枝限定法: 列挙せずに厳密な上位k件 / SA: 大規模メニュー向けのアニーリング")
+    solver_opts = {}
+    if solver_mode in ANNEALING_SOLVERS:
+        solver_opts["encoding"] = st.selectbox("制約エンコード", list(QUBO_ENCODINGS), format_func=QUBO_ENCODINGS.get, help="粗視化/Unbalancedはスラック変数を減らしてBQMを小さくします")
+    if solver_mode == "bnb":
+        solver_opts["min_diff"] = st.slider("プラン間の最小差分", 0, len(DIVERSE_CATEGORIES), 1, help="ヤサイ・アブラ・ニンニクのうち、他のプランと最低いくつ違えるか (0: 単純な上位k件)")
 
 # メインエリア: 制約 & 優先度
 c_limit, c_weight = st.columns([1, 1], gap="large")
@@ -262,9 +292,9 @@ c_limit, c_weight = st.columns([1, 1], gap="large")
 with c_limit:
     st.subheader("1. 本日のリミット設定")
     st.caption("健康と財布を守るためのライン")
-    budget = st.number_input("予算 (円)", 700, 2500, 1000, 50)
-    cal_limit = st.slider("カロリー上限 (kcal)", 1000, 3000, 1800, 50, help="【目安】成人男性の1日の推定必要カロリー: 約2600kcal")
-    sodium_limit = st.slider("塩分上限 (g)", 5.0, 15.0, 8.0, 0.5, help="【目安】成人男性の1日の目標量: 7.5g未満")
+    budget = st.number_input("予算 (円)", 700, LIMIT_MAX["price"], 1000, 50)
+    cal_limit = st.slider("カロリー上限 (kcal)", 1000, LIMIT_MAX["cal"], 1800, 50, help="【目安】成人男性の1日の推定必要カロリー: 約2600kcal")
+    sodium_limit = st.slider("塩分上限 (g)", 5.0, LIMIT_MAX["sodium"], 8.0, 0.5, help="【目安】成人男性の1日の目標量: 7.5g未満")
 
 with c_weight:
     st.subheader("2. 今日の気分・優先度")
@@ -284,89 +314,279 @@ with c_weight:
         "topping": transform_weight(u_topping), "soup_option": transform_weight(u_topping)
     }
 
+limits = {"cal": cal_limit, "sodium": sodium_limit, "price": budget}
+
+# 即時プレビュー: 事前計算したオーダーインデックスを引くだけなので最適化は走らない
+# 開いているときだけ実行する (閉じていればインデックスの構築も散布図の送信もしない)
+preview = st.expander("📈 即時プレビュー (パレートフロンティア)", key="preview", on_change="rerun")
+if preview.open:
+    with preview:
+        if not exact_ok:
+            st.info(f"この店舗は全{catalog.order_count():,}オーダーあり、事前計算できないためプレビューは使えません")
+        else:
+            with st.spinner("オーダーインデックスを準備中..."):
+                order_index = get_order_index(catalog)
+            feasible_idx = order_index.within(limits)
+            best_now = order_index.scores(weights_map)[feasible_idx].max() if len(feasible_idx) else None
+            m1, m2 = st.columns(2)
+            m1.metric("リミット内のオーダー", f"{len(feasible_idx)} / {len(order_index)}")
+            m2.metric("最高スコア", f"{best_now:.1f}" if best_now is not None else "-")
+            front_res = st.radio("横軸", list(RESOURCE_LABELS), format_func=RESOURCE_LABELS.get, horizontal=True)
+            st.plotly_chart(draw_pareto_chart(order_index, weights_map, front_res, limits), use_container_width=True, key="pareto")
+
+# スイープ・グループ最適化もSolveと同じ共有キューのジョブ。状態はセッションに持たせ、
+# 計算中だけフラグメントを POLL_INTERVAL ごとに再実行してポーリングする (スクリプト全体はブロックしない)
+POLL_INTERVAL = 0.25
+
+def busy_message():
+    return f"🚧 混雑中です ({get_solve_queue().depth()}件の計算が進行中)。少し待ってから再度実行してください。"
+
+def cancel_jobs(state):
+    if state is None: return
+    with state["lock"]:
+        for job in state["jobs"].values(): job.cancel()
+        state["jobs"].clear()
+
+def pump_sweep(state):
+    # 終わったチェーンを回収し、空いた枠にだけ次のチェーンを投入する (1セッションで同時に使うのはワーカー数まで)
+    # チェーンの完了時にもワーカースレッドから呼ばれるので、ポーリングを待たずに次が流れる
+    with state["lock"]:
+        _pump_sweep(state)
+
+def _pump_sweep(state):
+    queue = get_solve_queue()
+    for (si, ci), job in list(state["jobs"].items()):
+        if not job.future.done(): continue
+        del state["jobs"][(si, ci)]
+        if job.status != "done":
+            state["error"] = str(job.future.exception()) if job.status == "failed" else "cancelled"
+            cancel_jobs(state)
+            state["todo"].clear()
+            return
+        state["best"][si, ci], state["seconds"][si, ci] = job.result()
+    while state["todo"] and len(state["jobs"]) < queue.workers:
+        si, ci = state["todo"][0]
+        try:
+            job = queue.submit_task(sweep_chain, state["weights"], state["budgets"], state["cals"][ci], state["sods"][si], solver=state["solver"], catalog=state["catalog"], **state["opts"])
+        except SolverBusy:
+            break
+        state["jobs"][(si, ci)] = job
+        state["todo"].pop(0)
+        job.future.add_done_callback(lambda _: pump_sweep(state))
+    if not state["todo"] and not state["jobs"] and state["wall"] is None:
+        state["wall"] = time.perf_counter() - state["started"]
+
+def sweep_pending():
+    state = st.session_state.get("sweep")
+    return state is not None and state["error"] is None and state["wall"] is None
+
+def group_pending():
+    state = st.session_state.get("group")
+    return state is not None and not state["jobs"]["group"].future.done()
+
+# 感度分析: 予算 × カロリー × 塩分 の格子で最高スコアを一括計算
+def sweep_section(polling):
+    with st.expander("🔍 感度分析 (リミットスイープ)", expanded="sweep" in st.session_state):
+        st.caption("「あと100円 / 0.5g 増やしたら満足度はどれだけ上がる？」を格子状にまとめて計算します (計算エンジンはサイドバーの設定)")
+        sw_budget = st.slider("予算レンジ (100円刻み)", 700, LIMIT_MAX["price"], (800, 1400), 100)
+        sw_cal = st.slider("カロリーレンジ (200kcal刻み)", 1000, LIMIT_MAX["cal"], (1400, 2200), 200)
+        sw_sod = st.slider("塩分レンジ (0.5g刻み)", 5.0, LIMIT_MAX["sodium"], (7.0, 9.0), 0.5)
+        sw_budgets = list(range(sw_budget[0], sw_budget[1] + 1, 100))
+        sw_cals = list(range(sw_cal[0], sw_cal[1] + 1, 200))
+        sw_sods = [sw_sod[0] + 0.5 * k for k in range(int(round((sw_sod[1] - sw_sod[0]) / 0.5)) + 1)]
+
+        if st.button(f"スイープ実行 ({len(sw_budgets) * len(sw_cals) * len(sw_sods)}点)"):
+            # (塩分, カロリー) ごとのチェーンを1ジョブずつ共有キューへ (空き枠ができるたびに次を投入)
+            cancel_jobs(st.session_state.get("sweep"))
+            shape = (len(sw_sods), len(sw_cals), len(sw_budgets))
+            st.session_state["sweep"] = {
+                "weights": dict(weights_map), "solver": solver_mode, "opts": dict(solver_opts), "catalog": catalog,
+                "budgets": sw_budgets, "cals": sw_cals, "sods": sw_sods, "todo": list(itertools.product(range(shape[0]), range(shape[1]))),
+                "jobs": {}, "best": np.full(shape, np.nan), "seconds": np.zeros(shape), "started": time.perf_counter(), "wall": None, "error": None, "lock": threading.RLock(),
+            }
+            pump_sweep(st.session_state["sweep"])
+            st.rerun()
+
+        state = st.session_state.get("sweep")
+        if state is None: return
+        if state["catalog"] != catalog:
+            cancel_jobs(state)
+            del st.session_state["sweep"]
+            return
+        pump_sweep(state)
+        if state["error"] is not None:
+            st.error(f"スイープに失敗しました: {state['error']}")
+            return
+        if state["wall"] is None:
+            chains = len(state["sods"]) * len(state["cals"])
+            waiting = "" if state["jobs"] else " (キュー混雑のため待機中)"
+            st.info(f"スイープ計算中... {chains - len(state['todo']) - len(state['jobs'])}/{chains}チェーン完了 ({time.perf_counter() - state['started']:.1f}s){waiting}")
+            return
+        if polling: st.rerun()
+
+        sec = state["seconds"]
+        st.caption(f"総所要時間 {state['wall']:.2f}s / 1点あたり 平均 {sec.mean() * 1000:.1f}ms・最大 {sec.max() * 1000:.1f}ms")
+        for tab, si in zip(st.tabs([f"塩分 {v:.1f}g" for v in state["sods"]]), range(len(state["sods"]))):
+            with tab:
+                h1, h2 = st.columns([3, 2])
+                with h1: st.plotly_chart(draw_sweep_heatmap(state["best"][si], state["budgets"], state["cals"], "最高スコア", "{:.0f}", "YlOrRd"), use_container_width=True, key=f"sweep_best_{si}")
+                with h2: st.plotly_chart(draw_sweep_heatmap(sec[si] * 1000, state["budgets"], state["cals"], "ms", "{:.0f}", "Blues"), use_container_width=True, key=f"sweep_time_{si}")
+
+st.fragment(sweep_section, run_every=POLL_INTERVAL if sweep_pending() else None)(sweep_pending())
+
+# グループ注文: 全員の合計予算を共有し、カロリー・塩分・好みは各自で設定
+GROUP_COLUMNS = {"noodle": "麺", "punch": "アブラ・ニンニク", "vege": "ヤサイ", "pork": "豚", "topping": "トッピング"}
+def group_section(polling):
+    with st.expander("👥 グループ注文 (共有予算)", expanded="group" in st.session_state):
+        if not exact_ok:
+            st.info("この店舗は全オーダーを事前計算できないため、グループ注文は使えません")
+            return
+        st.caption("1人1行。好みは 0.0(妥協可) 〜 1.0(絶対欲しい)")
+        group_df = st.data_editor(
+            [{"名前": f"{n}さん", "カロリー上限": 1800, "塩分上限": 8.0, **{label: 0.5 for label in GROUP_COLUMNS.values()}} for n in ["A", "B", "C"]],
+            num_rows="dynamic", use_container_width=True, key="group_diners",
+            column_config={
+                "カロリー上限": st.column_config.NumberColumn(min_value=1000, max_value=LIMIT_MAX["cal"], step=50),
+                "塩分上限": st.column_config.NumberColumn(min_value=5.0, max_value=LIMIT_MAX["sodium"], step=0.5),
+                **{label: st.column_config.NumberColumn(min_value=0.0, max_value=1.0, step=0.1) for label in GROUP_COLUMNS.values()},
+            },
+        )
+        diners = []
+        for row in group_df:
+            if row.get("名前") is None: continue
+            w = {k: transform_weight(row.get(label) if row.get(label) is not None else 0.5) for k, label in GROUP_COLUMNS.items()}
+            diners.append({
+                "name": row["名前"], "limits": {"cal": row.get("カロリー上限") or cal_limit, "sodium": row.get("塩分上限") or sodium_limit},
+                "weights": {"noodle": w["noodle"], "fat": w["punch"], "garlic": w["punch"], "vege": w["vege"], "pork": w["pork"], "topping": w["topping"], "soup_option": w["topping"]},
+            })
+        group_budget = st.number_input("合計予算 (円)", 700, 1_000_000, 1000 * max(len(diners), 1), 50)
+
+        if st.button(f"グループ最適化 ({len(diners)}人)", disabled=not diners):
+            cancel_jobs(st.session_state.pop("group", None))
+            try:
+                job = get_solve_queue().submit_task(solve_group, diners, group_budget, catalog=catalog)
+            except SolverBusy:
+                st.error(busy_message())
+            else:
+                st.session_state["group"] = {"jobs": {"group": job}, "budget": group_budget, "catalog": catalog, "lock": threading.RLock()}
+                st.rerun()
+
+        state = st.session_state.get("group")
+        if state is None: return
+        job = state["jobs"]["group"]
+        if state["catalog"] != catalog:
+            job.cancel()
+            del st.session_state["group"]
+            return
+        if not job.future.done():
+            st.info(f"グループ最適化中... ({job.elapsed():.1f}s)")
+            return
+        if polling: st.rerun()
+        if job.status != "done":
+            st.error(f"グループ最適化に失敗しました: {job.future.exception() if job.status == 'failed' else 'cancelled'}")
+            return
+
+        group = job.result()
+        total = group["total"]
+        st.caption(f"合計 {total['price']:,}円 / 予算 {state['budget']:,}円 ・ 合計満足度 {total['final_score']:.1f} ・ "
+                   f"計算 {sum(group['info']['timings'].values()) * 1000:.1f}ms ({group['info']['frontier_points']}候補から配分)")
+        if group["is_approximate"]:
+            st.warning("⚠️ 予算または個人のリミットを満たせない人がいます。条件に近いオーダーを表示します。")
+        for tab, d in zip(st.tabs([d["name"] for d in group["diners"]]), group["diners"]):
+            with tab:
+                st.markdown(f'<div class="jiro-call">{d["call"]}<div class="jiro-call-sub">MAKE IT A GREAT DAY</div></div>', unsafe_allow_html=True)
+                st.markdown(ticket_html(d["items"], catalog), unsafe_allow_html=True)
+                stats = d["stats"]
+                st.caption(f"💰 {int(stats['price'])}円 | 🔥 {int(stats['cal'])}kcal | 🧂 {stats['sodium']:.1f}g | 満足度 {stats['final_score']:.1f}"
+                           + (" (個人リミット超過)" if d["is_approximate"] else ""))
+
+st.fragment(group_section, run_every=POLL_INTERVAL if group_pending() else None)(group_pending())
+
 st.write("")
 solve_btn = st.button("最適化を実行 (Solve)", type="primary", use_container_width=True)
 
 # --- ソルバー実行 & 結果表示 ---
+# 計算は共有キューのバックグラウンドジョブ。セッションにはジョブだけ持たせ、再実行のたびに状態をポーリングする
+JOB_STATUS_LABELS = {"queued": "待機中", "running": "最適化計算中"}
+
+solve_queue = get_solve_queue()
+job = st.session_state.get("solve_job")
+if job is not None and (solve_btn or job.catalog != catalog):
+    # 新しい実行や店舗の切り替えで古いジョブは不要になる
+    job.cancel()
+    job = st.session_state["solve_job"] = None
+
 if solve_btn:
+    try:
+        job = st.session_state["solve_job"] = solve_queue.submit(weights_map, limits, top_k=3, solver=solver_mode, catalog=catalog, **solver_opts)
+    except SolverBusy:
+        st.error(busy_message())
+
+# スクリプト実行時間 (プロセス全体で集計、最初の1回がコールドスタート)
+COLD_START_BUDGET_MS = float(os.environ.get("JIRO_COLD_START_BUDGET_MS", 3000))
+RERUN_BUDGET_MS = float(os.environ.get("JIRO_RERUN_BUDGET_MS", 200))
+
+@st.cache_resource(show_spinner=False)
+def run_timings():
+    return {"cold_start": None, "reruns": collections.deque(maxlen=500)}
+
+def record_run_time():
+    ms = (time.perf_counter() - t_script) * 1000
+    timings = run_timings()
+    budget = COLD_START_BUDGET_MS if timings["cold_start"] is None else RERUN_BUDGET_MS
+    if timings["cold_start"] is None: timings["cold_start"] = ms
+    else: timings["reruns"].append(ms)
+    if ms > budget: logging.getLogger("jiro").warning("script run %.0fms exceeded budget %.0fms", ms, budget)
+
+# 管理・デバッグ用パネル (?debug=1 で表示)
+if DEBUG:
+    with st.sidebar.expander("🧰 管理・デバッグ", expanded=True):
+        cache_stats = get_result_cache().stats()
+        d1, d2 = st.columns(2)
+        d1.metric("キャッシュヒット", cache_stats["hits"])
+        d2.metric("キャッシュミス", cache_stats["misses"])
+        st.caption(f"ヒット率 {cache_stats['hit_rate']:.0%} / {cache_stats['size']}/{cache_stats['maxsize']}件 (ディスクから {cache_stats['disk_hits']}件"
+                   f"{'' if cache_stats['persistent'] else '・永続化なし'}) / キュー {solve_queue.depth()}/{solve_queue.max_pending}件")
+        timings = run_timings()
+        if timings["cold_start"] is not None:
+            reruns = np.array(timings["reruns"])
+            rerun_text = f"再実行 p50 {np.percentile(reruns, 50):.0f}ms・p95 {np.percentile(reruns, 95):.0f}ms ({len(reruns)}回 / 予算超過 {(reruns > RERUN_BUDGET_MS).sum()}回)" if len(reruns) else "再実行 -"
+            st.caption(f"コールドスタート {timings['cold_start']:.0f}ms (予算 {COLD_START_BUDGET_MS:.0f}ms) / {rerun_text} / ソルバー読込: {'済' if 'neal' in sys.modules else '未'}")
+
+if job is not None:
     st.subheader("📊 Optimization Results")
     status_text = st.empty()
-    status_text.info("最適化計算中... (Simulated Annealing)")
-    
-    # QUBO構築
-    x = Array.create('x', shape=num_items, vartype='BINARY')
-    H_obj = 0
-    for i, n in enumerate(item_names):
-        cat = items_data[n]["cat"]
-        w = weights_map.get(cat, 1.0)
-        if cat in ["soup_option", "topping"]: w = weights_map.get("topping", 1.0)
-        H_obj += -1 * items_data[n]["satisfaction"] * w * x[i]
-
-    idx_map = {n: i for i, n in enumerate(item_names)}
-    H_randle = 0
-    for c_item in high_carb_items:
-        for f_item in high_fat_items:
-            if c_item in idx_map and f_item in idx_map: H_randle += 50.0 * x[idx_map[c_item]] * x[idx_map[f_item]]
-    
-    H_synergy = 0
-    for l_item in low_carb_items:
-        for v_item in volumey_vege:
-            if l_item in idx_map and v_item in idx_map: H_synergy += -30.0 * x[idx_map[l_item]] * x[idx_map[v_item]]
-
-    curr_sod = sum(items_data[n]["sodium"] * x[i] for i, n in enumerate(item_names))
-    s_sod = LogEncInteger("s_sod", (0, int(sodium_limit * 10) + 5))
-    H_sod = Constraint((curr_sod * 10 + s_sod - int(sodium_limit * 10))**2, label="Sodium")
-    
-    curr_cal = sum(items_data[n]["cal"] * x[i] for i, n in enumerate(item_names))
-    s_cal = LogEncInteger("s_cal", (0, int(cal_limit) + 100))
-    H_cal = Constraint((curr_cal + s_cal - cal_limit)**2, label="Calorie")
-    
-    curr_price = sum(items_data[n]["price"] * x[i] for i, n in enumerate(item_names))
-    s_price = LogEncInteger("s_price", (0, budget))
-    H_price = Constraint((curr_price + s_price - budget)**2, label="Price")
-    
-    H_exclusive = 0
-    for cat in target_categories:
-        indices = [i for i, n in enumerate(item_names) if items_data[n]["cat"] == cat]
-        H_exclusive += Constraint((sum(x[i] for i in indices) - 1)**2, label=f"OneHot_{cat}")
-
-    M = 5000.0
-    H = H_obj + H_randle + H_synergy + M*(H_sod + H_cal + H_price + H_exclusive)
-    
-    model = H.compile()
-    bqm = model.to_bqm()
-    sampler = neal.SimulatedAnnealingSampler()
-    response = sampler.sample(bqm, num_reads=1000, num_sweeps=1000, beta_range=(0.1, 5.0))
-    
-    decoded_samples = model.decode_sampleset(response)
-    valid_plans, compromise_plans, seen_configs = [], [], set()
-
-    for d_sample in decoded_samples:
-        sample_dict = d_sample.sample
-        current_config = tuple(sample_dict[f"x[{i}]"] for i in range(num_items))
-        if current_config in seen_configs: continue
-        seen_configs.add(current_config)
-
-        sel_items = [n for idx, n in enumerate(item_names) if sample_dict.get(f"x[{idx}]") == 1]
-        
-        # バリデーション
-        if not any(items_data[n]["cat"] == "noodle" for n in sel_items): continue
-        is_cat_broken = False
-        for cat in target_categories:
-            if sum(1 for item in sel_items if items_data[item]["cat"] == cat) != 1:
-                is_cat_broken = True; break
-        if is_cat_broken: continue
-
-        check_stats = calculate_details(sel_items, weights_map)
-        is_over = (check_stats["price"] > budget) or (check_stats["cal"] > cal_limit) or (check_stats["sodium"] > sodium_limit)
-        
-        plan_data = {"sample": sample_dict, "stats": check_stats, "energy": d_sample.energy}
-        if not is_over: valid_plans.append(plan_data)
-        else: compromise_plans.append(plan_data)
+    if not job.wait(POLL_INTERVAL):
+        status = job.status
+        msg = f"{JOB_STATUS_LABELS.get(status, '最適化計算中')}... ({SOLVER_LABELS[job.solver]} / {job.elapsed():.1f}s)"
+        if status == "queued": msg += f" 前に{solve_queue.position(job)}件"
+        if job.progress: msg += f" {job.progress[0]}/{job.progress[1]} reads"
+        status_text.info(msg)
+        time.sleep(POLL_INTERVAL)
+        st.rerun()
+
+    if job.status == "failed":
+        status_text.error(f"計算に失敗しました: {job.future.exception()}")
+        st.stop()
+    result = job.result()
+    final_plans, is_approximate, solve_info = result["plans"], result["is_approximate"], result["info"]
 
     status_text.empty()
-    final_plans = sorted(valid_plans, key=lambda x: x["energy"])[:3] if valid_plans else sorted(compromise_plans, key=lambda x: x["energy"])[:3]
-    is_approximate = not valid_plans
+    if job.cached: st.caption("⚡ キャッシュ済みの結果を表示しています")
+    if job.weights != weights_map or job.limits != limits:
+        st.caption("ℹ️ 表示中の結果は前回 Solve 時の設定です (設定を反映するには再度 Solve)")
+    if job.solver in ANNEALING_SOLVERS:
+        st.caption(f"BQM: {solve_info['bqm_vars']}変数 / {solve_info['bqm_interactions']}相互作用 (標準エンコード: {solve_info['base_vars']}変数 / {solve_info['base_interactions']}相互作用)")
+        spent = f"実行: {solve_info['reads']} reads × {solve_info['sweeps']} sweeps"
+        if "stop_reason" in solve_info:
+            spent += f" ({solve_info['batches']}バッチ / 停止理由: {STOP_REASON_LABELS[solve_info['stop_reason']]} / β={solve_info['beta_range'][0]:.2g}〜{solve_info['beta_range'][1]:.2g})"
+        st.caption(spent)
+    elif job.solver == "bnb":
+        pruned_by = solve_info["pruned_by"]
+        st.caption(f"全{solve_info['orders']}オーダー中 探索ノード {solve_info['nodes']} / 枝刈り {solve_info['pruned']} "
+                   f"(リミット {pruned_by['resource']} / 上界 {pruned_by['bound']} / 多様性 {pruned_by['diversity']})")
+    else:
+        st.caption(f"全{solve_info['orders']}オーダー中 {solve_info['feasible']}件がリミット内")
 
     if not final_plans:
         st.error("有効なオーダーが見つかりませんでした。条件を緩和してください。")
@@ -375,40 +595,24 @@ if solve_btn:
     if is_approximate:
         st.warning("⚠️ 指定された制約を厳密に満たすプランが見つかりませんでした。条件に近いプランを表示します。")
 
-    u_stats = calculate_details(user_selection, weights_map) if enable_comparison and user_selection else None
-    limits = {"cal": cal_limit, "sodium": sodium_limit, "price": budget}
-    
-    tabs = st.tabs([f"🏆 プラン A (Best)" if i==0 else f"プラン {chr(65+i)}" for i in range(len(final_plans))])
+    u_stats = calculate_details(user_selection, job.weights, catalog) if enable_comparison and user_selection else None
     
+    # 表示中のタブだけ図を作る (タブを切り替えると再実行されて、そのタブが描画される)
+    tabs = st.tabs([f"🏆 プラン A (Best)" if i==0 else f"プラン {chr(65+i)}" for i in range(len(final_plans))], key="plan_tabs", on_change="rerun")
+    render_stats = {"figures": 0, "bytes": 0}
+    def plot_cached(fig_bytes, **kwargs):
+        fig, nbytes = fig_bytes
+        render_stats["figures"] += 1
+        render_stats["bytes"] += nbytes
+        st.plotly_chart(fig, **kwargs)
+
+    t_render = time.perf_counter()
     for i, (tab, plan) in enumerate(zip(tabs, final_plans)):
+        if not tab.open: continue
         with tab:
-            sample = plan["sample"]
             stats = plan["stats"]
-            sel_list = [n for idx, n in enumerate(item_names) if sample.get(f"x[{idx}]") == 1]
-            
-            # --- コール生成 ---
-            sel_vege = next((n for n in sel_list if items_data[n]["cat"] == "vege"), "")
-            sel_garlic = next((n for n in sel_list if items_data[n]["cat"] == "garlic"), "")
-            sel_fat = next((n for n in sel_list if items_data[n]["cat"] == "fat"), "")
-            
-            call_parts = []
-            is_default = ("無し" in sel_garlic and "普通" in sel_vege and ("普通" in sel_fat or "無し" in sel_fat))
-            
-            if is_default:
-                final_call = "そのままで"
-            else:
-                if "少なめ" in sel_garlic: call_parts.append("ニンニク少なめ")
-                elif "普通" in sel_garlic: call_parts.append("ニンニク")
-                elif "増し" in sel_garlic: call_parts.append("ニンニクマシ")
-                
-                if "少なめ" in sel_vege: call_parts.append("ヤサイ少なめ")
-                elif "マシマシ" in sel_vege: call_parts.append("ヤサイマシマシ")
-                elif "マシ" in sel_vege: call_parts.append("ヤサイ")
-                
-                if "マシマシ" in sel_fat: call_parts.append("アブラマシマシ")
-                elif "マシ" in sel_fat: call_parts.append("アブラ")
-
-                final_call = " ".join(call_parts) if call_parts else "そのままで"
+            sel_list = plan["items"]
+            final_call = plan["call"]
 
             # 表示
             st.markdown(f'<div class="jiro-call">{final_call}<div class="jiro-call-sub">MAKE IT A GREAT DAY</div></div>', unsafe_allow_html=True)
@@ -426,29 +630,38 @@ if solve_btn:
             with col_gauges:
                 g1, g2, g3 = st.columns(3)
                 # 【修正】 use_container_width=False に変更（固定幅で描画させるため）
-                with g1: st.plotly_chart(create_gauge(stats['cal'], cal_limit, "カロリー", "kcal", mode="health_cal"), use_container_width=False, key=f"gc{i}")
-                with g2: st.plotly_chart(create_gauge(stats['sodium'], sodium_limit, "塩分", "g", mode="health_sod"), use_container_width=False, key=f"gs{i}")
-                with g3: st.plotly_chart(create_gauge(stats['price'], budget, "価格", "円", mode="budget"), use_container_width=False, key=f"gp{i}")
+                with g1: plot_cached(create_gauge(stats['cal'], job.limits["cal"], "カロリー", "kcal", mode="health_cal"), use_container_width=False, key=f"gc{i}")
+                with g2: plot_cached(create_gauge(stats['sodium'], job.limits["sodium"], "塩分", "g", mode="health_sod"), use_container_width=False, key=f"gs{i}")
+                with g3: plot_cached(create_gauge(stats['price'], job.limits["price"], "価格", "円", mode="budget"), use_container_width=False, key=f"gp{i}")
 
             st.markdown("---")
             r1, r2 = st.columns([1, 1])
             with r1:
-                st.plotly_chart(draw_radar_chart(stats, u_stats, limits), use_container_width=True, key=f"radar_{i}")
+                plot_cached(draw_radar_chart(stats, u_stats, job.limits), use_container_width=True, key=f"radar_{i}")
             
             with r2:
                 st.write("#### 📝 構成内容（食券）")
-                tags_html = '<div class="ticket-container">'
-                for item in sel_list:
-                    cat = items_data[item]["cat"]
-                    cat_class = f"ticket-{cat}" if cat in ["noodle", "pork", "vege", "fat", "garlic", "topping", "soup_option"] else "ticket-topping"
-                    tags_html += f'<div class="ticket {cat_class}">{item}</div>'
-                tags_html += '</div>'
-                st.markdown(tags_html, unsafe_allow_html=True)
+                st.markdown(ticket_html(sel_list, catalog), unsafe_allow_html=True)
                 
-                if stats["randle_penalty"] > 0: st.warning(f"⚠️ 糖質×脂質 ペナルティ (-{stats['randle_penalty']})")
-                if stats["diet_bonus"] > 0: st.success(f"✨ 減量シナジー ボーナス (+{stats['diet_bonus']})")
+                for label, v in stats["interactions"].items():
+                    if v < 0: st.warning(f"⚠️ {label} ({v:+g})")
+                    else: st.success(f"✨ {label} ({v:+g})")
             
             st.markdown("---")
             tweet_text = f"【Jiro Order Optimizer】\n私の最適化プラン: {final_call}\n💰 {int(stats['price'])}円 | 🔥 {int(stats['cal'])}kcal | 🧂 {stats['sodium']:.1f}g\n満足度スコア: {stats['final_score']:.1f}\n#JiroOrderOptimizer"
             share_url = f"https://twitter.com/intent/tweet?text={urllib.parse.quote(tweet_text)}"
-            st.link_button("X (Twitter) でオーダーをポスト", share_url)
\ No newline at end of file
+            st.link_button("X (Twitter) でオーダーをポスト", share_url)
+
+    now = time.perf_counter()
+    get_metrics().observe_render(now - t_render, render_stats["figures"], render_stats["bytes"])
+    if DEBUG:
+        st.caption(f"描画: {render_stats['figures']}図 / {render_stats['bytes'] / 1024:.1f}KB / 結果描画 {(now - t_render) * 1000:.0f}ms / スクリプト開始から {(now - t_script) * 1000:.0f}ms")
+        with st.expander("⏱️ ステージ別計測"):
+            stage_ms = {stage: sec * 1000 for stage, sec in solve_info.get("timings", {}).items()}
+            if not job.cached: stage_ms["queue_wait"] = (job.started_at - job.submitted_at) * 1000
+            stage_ms["render"] = (now - t_render) * 1000
+            st.table({"ステージ": list(stage_ms), "ms": [f"{v:.1f}" for v in stage_ms.values()]})
+            counts = {k: solve_info[k] for k in ("bqm_vars", "bqm_interactions", "reads", "unique", "feasible", "orders", "nodes", "pruned") if k in solve_info}
+            st.caption(" / ".join(f"{k}: {v}" for k, v in counts.items()) + (" (キャッシュ: 計測値は初回実行時のもの)" if job.cached else ""))
+
+record_run_time()
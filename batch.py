@@ -0,0 +1,97 @@
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+import pandas as pd
+
+from catalog import DEFAULT_CATALOG, DEFAULT_SHOP, load_catalogs
+from engine import SOLVERS, weight_keys, solve
+
+# 顧客プロファイルを一括最適化するバッチ
+#   python batch.py profiles.csv -o plans.csv --workers 8
+# 入力列: profile_id, budget, cal_limit, sodium_limit と各カテゴリの重み (noodle, pork, vege, fat, garlic, topping)
+# 重み列が無いカテゴリは 1.0 として扱う
+# --catalog を指定すると shop_id 列の店舗メニューで解く (shop_id 列が無ければ先頭の店舗)
+
+def read_profiles(path, chunksize):
+    if path.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, chunksize=chunksize)
+
+class PlanWriter:
+    def __init__(self, path):
+        self.path = path
+        self.parquet_writer = None
+        self.wrote_header = False
+
+    def write(self, df):
+        if self.path.endswith(".parquet"):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.parquet_writer is None: self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+            self.parquet_writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode="a" if self.wrote_header else "w", header=not self.wrote_header, index=False)
+            self.wrote_header = True
+
+    def close(self):
+        if self.parquet_writer is not None: self.parquet_writer.close()
+
+def profile_catalog(profile, catalog_path):
+    # カタログのパースはワーカーごとに1回 (load_catalogs がキャッシュ)
+    if catalog_path is None: return DEFAULT_CATALOG
+    catalogs = load_catalogs(catalog_path)
+    shop_id = profile.get("shop_id")
+    return catalogs[str(shop_id)] if shop_id is not None and not pd.isna(shop_id) else next(iter(catalogs.values()))
+
+def solve_profile(profile, top_k, solver, catalog_path=None):
+    weights = {k: float(profile.get(k, 1.0)) for k in weight_keys}
+    weights["soup_option"] = weights["topping"]
+    limits = {"price": int(profile["budget"]), "cal": int(profile["cal_limit"]), "sodium": float(profile["sodium_limit"])}
+    catalog = profile_catalog(profile, catalog_path)
+    result = solve(weights, limits, top_k=top_k, solver=solver, catalog=catalog)
+
+    rows = []
+    for rank, plan in enumerate(result["plans"], start=1):
+        stats = plan["stats"]
+        rows.append({
+            "profile_id": profile["profile_id"], "shop_id": catalog.shop_id, "rank": rank, "call": plan["call"], "items": " / ".join(plan["items"]),
+            "final_score": stats["final_score"], "cal": stats["cal"], "sodium": stats["sodium"], "price": stats["price"],
+            "is_approximate": result["is_approximate"],
+        })
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Jiro Order Optimizer バッチ実行")
+    parser.add_argument("profiles", help="プロファイル (CSV / Parquet)")
+    parser.add_argument("-o", "--output", required=True, help="出力先 (CSV / Parquet)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="ワーカープロセス数")
+    parser.add_argument("--solver", choices=list(SOLVERS), default="exact")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--catalog", default=None, help=f"店舗カタログ (CSV / Parquet、省略時は {DEFAULT_SHOP} のメニュー)")
+    parser.add_argument("--chunksize", type=int, default=10000, help="一度に読み込むプロファイル数")
+    args = parser.parse_args(argv)
+
+    writer = PlanWriter(args.output)
+    n_profiles = 0
+    t_start = time.perf_counter()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for chunk in read_profiles(args.profiles, args.chunksize):
+            profiles = chunk.to_dict("records")
+            results = pool.map(solve_profile, profiles, [args.top_k] * len(profiles), [args.solver] * len(profiles), [args.catalog] * len(profiles),
+                               chunksize=max(1, len(profiles) // (args.workers * 4)))
+            writer.write(pd.DataFrame([row for rows in results for row in rows]))
+
+            n_profiles += len(profiles)
+            elapsed = time.perf_counter() - t_start
+            print(f"{n_profiles} profiles / {elapsed:.1f}s ({n_profiles / elapsed:.1f} profiles/sec)", file=sys.stderr)
+    writer.close()
+
+if __name__ == "__main__":
+    main()
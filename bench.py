@@ -0,0 +1,149 @@
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from catalog import DEFAULT_CATALOG, load_catalogs
+from engine import LIMIT_MAX, get_order_index, solve
+
+# ソルバーの品質・速度ベンチマーク
+#   python bench.py --scenarios 50 --seed 0 -o bench.json
+#   python bench.py --settings sa_default,sa_unbalanced --repeats 3 -o bench.json
+# スライダーの刻みに沿ったランダムな (重み, リミット) シナリオを再現可能に生成し、
+# 全列挙の最適値を基準に各設定のアニーリングを評価する
+# 出力 (JSON): meta (リビジョン・引数), summary (設定ごとの集計), runs (1実行1レコード)
+
+# 設定名 → (solver, solver_opts)
+SETTINGS = {
+    "sa_default": ("sa", {}),
+    "sa_fast": ("sa", {"num_reads": 200, "num_sweeps": 100}),
+    "sa_scaled": ("sa", {"encoding": "scaled"}),
+    "sa_unbalanced": ("sa", {"encoding": "unbalanced"}),
+    "sa_m500": ("sa", {"strength": 500.0}),
+    "sa_m50000": ("sa", {"strength": 50000.0}),
+    "sa_beta_wide": ("sa", {"beta_range": (0.01, 50.0)}),
+    "adaptive_log": ("sa_adaptive", {}),
+    "adaptive_scaled": ("sa_adaptive", {"encoding": "scaled"}),
+    "adaptive_unbalanced": ("sa_adaptive", {"encoding": "unbalanced"}),
+}
+DEFAULT_SETTINGS = ["sa_default", "sa_fast", "sa_unbalanced", "adaptive_scaled", "adaptive_unbalanced"]
+STAGES = ["expression", "compile", "to_bqm", "sample", "decode", "validation"]
+
+def make_scenarios(n, seed):
+    # app.py のスライダーと同じ範囲・刻み (重みは 0.0〜1.0 の0.1刻みを 1.5v+0.5 に変換)
+    rng = np.random.default_rng(seed)
+    scenarios = []
+    for sid in range(n):
+        u = np.round(rng.integers(0, 11, size=5) / 10, 1)
+        w = 1.5 * u + 0.5
+        weights = {"noodle": w[0], "fat": w[1], "garlic": w[1], "vege": w[2], "pork": w[3], "topping": w[4], "soup_option": w[4]}
+        limits = {
+            "price": int(rng.integers(700 // 50, LIMIT_MAX["price"] // 50 + 1) * 50),
+            "cal": int(rng.integers(1000 // 50, LIMIT_MAX["cal"] // 50 + 1) * 50),
+            "sodium": float(rng.integers(10, int(LIMIT_MAX["sodium"] * 2) + 1) * 0.5),
+        }
+        scenarios.append({"scenario": sid, "weights": {k: float(v) for k, v in weights.items()}, "limits": limits})
+    return scenarios
+
+def exact_optimum(index, weights, limits):
+    # 全オーダーを列挙したインデックスから、リミット内の最高スコア (無ければ None)
+    feasible = index.within(limits)
+    return float(index.scores(weights)[feasible].max()) if len(feasible) else None
+
+def run_setting(name, scenario, optimum, catalog, seed):
+    solver, opts = SETTINGS[name]
+    t0 = time.perf_counter()
+    result = solve(scenario["weights"], scenario["limits"], top_k=1, solver=solver, catalog=catalog, seed=seed, **opts)
+    wall = time.perf_counter() - t0
+    info = result["info"]
+    found = result["plans"][0]["stats"]["final_score"] if result["plans"] and not result["is_approximate"] else None
+    gap = None
+    if optimum is not None:
+        gap = 1.0 if found is None else (optimum - found) / abs(optimum) if optimum else 0.0
+    return {
+        "setting": name, "scenario": scenario["scenario"], "seed": seed,
+        "optimum": optimum, "found": found, "gap": gap, "optimal": gap is not None and gap <= 1e-9,
+        "fallback": result["is_approximate"], "reads": info["reads"], "unique": info["unique"], "feasible": info["feasible"],
+        "yield": info["feasible"] / info["reads"], "bqm_vars": info["bqm_vars"],
+        "timings": {**dict.fromkeys(STAGES, 0.0), **info["timings"], "wall": wall},
+    }
+
+def summarize(runs):
+    summary = {}
+    for name in dict.fromkeys(r["setting"] for r in runs):
+        rs = [r for r in runs if r["setting"] == name]
+        scored = [r for r in rs if r["gap"] is not None]
+        gaps = np.array([r["gap"] for r in scored]) if scored else np.zeros(0)
+        summary[name] = {
+            "runs": len(rs),
+            "mean_gap": float(gaps.mean()) if len(gaps) else None,
+            "max_gap": float(gaps.max()) if len(gaps) else None,
+            "optimal_rate": float(np.mean([r["optimal"] for r in scored])) if scored else None,
+            # 実行可能なオーダーがあるのに妥協案に落ちた割合
+            "fallback_rate": float(np.mean([r["fallback"] for r in scored])) if scored else None,
+            "unique_feasible_yield": float(np.mean([r["yield"] for r in rs])),
+            "timings": {stage: {"mean": float(np.mean(t)), "p50": float(np.percentile(t, 50)), "p95": float(np.percentile(t, 95))}
+                        for stage in STAGES + ["wall"] for t in [[r["timings"][stage] for r in rs]]},
+        }
+    return summary
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Jiro Order Optimizer ソルバーベンチマーク")
+    parser.add_argument("-o", "--output", help="結果JSONの出力先 (省略時は標準出力)")
+    parser.add_argument("--scenarios", type=int, default=30, help="シナリオ数")
+    parser.add_argument("--seed", type=int, default=0, help="シナリオ生成とSAの乱数シード")
+    parser.add_argument("--repeats", type=int, default=1, help="シナリオごとの繰り返し回数 (SAのシードを変える)")
+    parser.add_argument("--settings", default=",".join(DEFAULT_SETTINGS), help=f"カンマ区切り ({', '.join(SETTINGS)})")
+    parser.add_argument("--catalog", default=None, help="店舗カタログ (CSV / Parquet)")
+    parser.add_argument("--shop", default=None, help="カタログ内の店舗ID (省略時は先頭)")
+    args = parser.parse_args(argv)
+
+    settings = args.settings.split(",")
+    unknown = [s for s in settings if s not in SETTINGS]
+    if unknown: parser.error(f"unknown settings: {', '.join(unknown)}")
+    if args.catalog is None: catalog = DEFAULT_CATALOG
+    else:
+        catalogs = load_catalogs(args.catalog)
+        catalog = catalogs[args.shop] if args.shop else next(iter(catalogs.values()))
+
+    index = get_order_index(catalog)
+    scenarios = make_scenarios(args.scenarios, args.seed)
+    optima = [exact_optimum(index, sc["weights"], sc["limits"]) for sc in scenarios]
+
+    # 初回のQUBOコンパイルを計測から外す (以降の expression / compile は0)
+    for name in settings: run_setting(name, scenarios[0], optima[0], catalog, args.seed)
+
+    runs = []
+    for name in settings:
+        for sc, opt in zip(scenarios, optima):
+            for rep in range(args.repeats):
+                runs.append(run_setting(name, sc, opt, catalog, args.seed * 1000003 + sc["scenario"] * 101 + rep))
+        s = summarize([r for r in runs if r["setting"] == name])[name]
+        # 全シナリオがリミット外 (最適値なし) だと gap 系は None
+        fmt = lambda v, spec: "-" if v is None else format(v, spec)
+        print(f"{name:22s} gap {fmt(s['mean_gap'], '.4f')}  optimal {fmt(s['optimal_rate'], '.0%')}  fallback {fmt(s['fallback_rate'], '.0%')}  "
+              f"yield {s['unique_feasible_yield']:.3f}  wall p50 {s['timings']['wall']['p50'] * 1000:.0f}ms", file=sys.stderr)
+
+    report = {
+        "meta": {"revision": git_revision(), "catalog": catalog.content_hash, "shop": catalog.shop_id, "scenarios": args.scenarios,
+                 "seed": args.seed, "repeats": args.repeats, "settings": {n: SETTINGS[n] for n in settings}},
+        "summary": summarize(runs),
+        "runs": runs,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=1)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f: f.write(text)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import functools
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# 店舗ごとのメニューカタログ (列指向)
+# CSV / Parquet の列: shop_id, item, category, cal, sodium, satisfaction, price, tags, optional
+#   tags: 相互作用タグを ";" 区切り (high_carb, high_fat, low_carb, volumey_vege)
+#   optional: 1 ならトッピング等の任意追加 (0/省略時は OPTIONAL_CATEGORIES で判定)、0 ならカテゴリから必ず1品
+
+OPTIONAL_CATEGORIES = ["soup_option", "topping"]
+
+# 品目ペアの相互作用ルール: a と b (品目名 or タグ) を両方頼むと満足度に coef を加える (負ならペナルティ)
+# 該当する品目ペアごとに加算する (QUBOの x_i x_j 項と同じ意味)。JIRO_INTERACTIONS にJSONのパスを渡すと差し替えられる
+DEFAULT_INTERACTIONS = [
+    {"name": "randle", "label": "糖質×脂質 ペナルティ", "a": "high_carb", "b": "high_fat", "coef": -50.0},
+    {"name": "diet", "label": "減量シナジー ボーナス", "a": "low_carb", "b": "volumey_vege", "coef": 30.0},
+]
+
+def load_interactions(path):
+    with open(path, encoding="utf-8") as f: rules = json.load(f)
+    return [{"name": r["name"], "label": r.get("label", r["name"]), "a": r["a"], "b": r["b"], "coef": float(r["coef"])} for r in rules]
+
+class Catalog:
+    # content_hash が同じカタログ同士は、モデル・インデックスのキャッシュを共有する (店舗IDは含めない)
+    def __init__(self, shop_id, names, categories, cal, sodium, satisfaction, price, tags, optional, interactions=None):
+        self.shop_id = shop_id
+        self.item_names = list(names)
+        self.num_items = len(self.item_names)
+        self.index_of = {n: i for i, n in enumerate(self.item_names)}
+
+        self.categories = np.asarray(categories, dtype=object)
+        self.cal = np.asarray(cal, dtype=np.int64)
+        self.sodium = np.asarray(sodium, dtype=float)
+        self.sodium10 = np.rint(self.sodium * 10).astype(np.int64)
+        self.satisfaction = np.asarray(satisfaction, dtype=float)
+        self.price = np.asarray(price, dtype=np.int64)
+        self.tags = [frozenset(t) for t in tags]
+        self.optional = np.asarray(optional, dtype=bool)
+
+        # カテゴリ → 品目インデックス (必須カテゴリは出現順)
+        self.cat_index = {cat: np.flatnonzero(self.categories == cat) for cat in dict.fromkeys(self.categories)}
+        self.target_categories = [cat for cat, idx in self.cat_index.items() if not self.optional[idx].any()]
+        self.opt_index = np.flatnonzero(self.optional)
+        self.items_by_cat = {cat: [self.item_names[i] for i in idx] for cat, idx in self.cat_index.items()}
+
+        # リソース列 [塩分(0.1g), カロリー, 価格] と カテゴリ所属行列 (X @ C で各カテゴリの選択数)
+        self.resources = np.column_stack([self.sodium10, self.cal, self.price])
+        # 1オーダーで取りうるリソースの最大 (各カテゴリの最大 + 全オプション)
+        self.max_resources = sum((self.resources[idx].max(axis=0) for cat, idx in self.cat_index.items() if cat in self.target_categories), self.resources[self.opt_index].sum(axis=0))
+        # int8同士の積はint8で桁あふれする (1カテゴリ257品 → 1) ので、選択数はint32で数える
+        self.category_matrix = np.stack([self.categories == cat for cat in self.target_categories], axis=1).astype(np.int32)
+
+        # 相互作用の疎行列 Q (上三角のCOO): pair_i < pair_j, pair_coef、ルール別の内訳は pair_rule
+        self.interactions = list(interactions if interactions is not None else DEFAULT_INTERACTIONS)
+        pairs = []
+        for r, rule in enumerate(self.interactions):
+            a, b = self.matches(rule["a"]), self.matches(rule["b"])
+            # a と b が重なる品目 (例: 同じタグ同士) では (i, j) と (j, i) が両方出るので、ルールごとに1組にまとめる
+            matched = sorted({(min(i, j), max(i, j)) for i in np.flatnonzero(a) for j in np.flatnonzero(b) if i != j})
+            pairs += [(i, j, rule["coef"], r) for i, j in matched]
+        self.pair_i = np.array([p[0] for p in pairs], dtype=np.intp)
+        self.pair_j = np.array([p[1] for p in pairs], dtype=np.intp)
+        self.pair_coef = np.array([p[2] for p in pairs], dtype=float)
+        self.pair_rule = np.zeros((len(pairs), len(self.interactions)))
+        self.pair_rule[np.arange(len(pairs)), [p[3] for p in pairs]] = self.pair_coef
+
+        h = hashlib.sha256()
+        for arr in (self.cal, self.sodium10, self.satisfaction, self.price, self.optional):
+            h.update(np.ascontiguousarray(arr).tobytes())
+        h.update("\x1f".join(self.item_names).encode())
+        h.update("\x1f".join(self.categories).encode())
+        h.update("\x1f".join(";".join(sorted(t)) for t in self.tags).encode())
+        h.update(json.dumps(self.interactions, sort_keys=True, ensure_ascii=False).encode())
+        self.content_hash = h.hexdigest()
+
+    def __hash__(self):
+        return hash(self.content_hash)
+
+    def __eq__(self, other):
+        return isinstance(other, Catalog) and self.content_hash == other.content_hash
+
+    def item_cat(self, name):
+        return self.categories[self.index_of[name]]
+
+    def items_in(self, *cats):
+        return [n for cat in cats for n in self.items_by_cat.get(cat, [])]
+
+    def matches(self, key):
+        # 相互作用ルールの a / b: 品目名かタグ
+        return np.array([key == n or key in t for n, t in zip(self.item_names, self.tags)], dtype=bool)
+
+    def order_count(self):
+        # 全オーダー数 = 必須カテゴリの品目数の積 × 任意品目の有無
+        return int(np.prod([len(self.cat_index[c]) for c in self.target_categories], dtype=float) * 2.0 ** len(self.opt_index))
+
+    @classmethod
+    def from_items_data(cls, shop_id, items_data, tags=None, interactions=None):
+        tags = tags or {}
+        names = list(items_data)
+        return cls(
+            shop_id, names, [items_data[n]["cat"] for n in names],
+            [items_data[n]["cal"] for n in names], [items_data[n]["sodium"] for n in names],
+            [items_data[n]["satisfaction"] for n in names], [items_data[n]["price"] for n in names],
+            [tags.get(n, ()) for n in names], [items_data[n]["cat"] in OPTIONAL_CATEGORIES for n in names], interactions,
+        )
+
+    @classmethod
+    def from_frame(cls, shop_id, df, interactions=None):
+        tags = df["tags"].fillna("") if "tags" in df else [""] * len(df)
+        optional = df["category"].isin(OPTIONAL_CATEGORIES)
+        if "optional" in df: optional = optional | df["optional"].fillna(0).astype(bool)
+        return cls(
+            shop_id, df["item"].tolist(), df["category"].tolist(),
+            df["cal"].to_numpy(), df["sodium"].to_numpy(), df["satisfaction"].to_numpy(), df["price"].to_numpy(),
+            [[t.strip() for t in s.split(";") if t.strip()] for s in tags], optional.to_numpy(), interactions,
+        )
+
+# --- 標準メニュー ---
+items_data = {
+    # 麺
+    "麺通常(300g)":   {"cal": 1000, "sodium": 6.0, "satisfaction": 150, "price": 700, "cat": "noodle"},
+    "麺少なめ(200g)": {"cal": 700,  "sodium": 5.0, "satisfaction": 100, "price": 700, "cat": "noodle"},
+    "麺半分(150g)":   {"cal": 550,  "sodium": 4.5, "satisfaction": 80,  "price": 700, "cat": "noodle"},
+    # 豚
+    "豚(2枚・標準)":  {"cal": 0,    "sodium": 0.0, "satisfaction": 50,  "price": 0,   "cat": "pork"},
+    "豚増し(5枚)":    {"cal": 500,  "sodium": 3.5, "satisfaction": 100, "price": 150, "cat": "pork"},
+    "豚ダブル(8枚)":  {"cal": 1000, "sodium": 7.0, "satisfaction": 160, "price": 250, "cat": "pork"},
+    # ヤサイ
+    "ヤサイ少なめ":   {"cal": 20,   "sodium": 0.0, "satisfaction": 20,  "price": 0,   "cat": "vege"},
+    "ヤサイ普通":     {"cal": 40,   "sodium": 0.0, "satisfaction": 40,  "price": 0,   "cat": "vege"},
+    "ヤサイマシ":     {"cal": 60,   "sodium": 0.0, "satisfaction": 60,  "price": 0,   "cat": "vege"},
+    "ヤサイマシマシ": {"cal": 100,  "sodium": 0.0, "satisfaction": 90,  "price": 0,   "cat": "vege"},
+    # アブラ
+    "アブラ無し":     {"cal": 0,    "sodium": 0.0, "satisfaction": 0,   "price": 0,   "cat": "fat"},
+    "アブラ普通":     {"cal": 100,  "sodium": 0.2, "satisfaction": 30,  "price": 0,   "cat": "fat"},
+    "アブラマシ":     {"cal": 270,  "sodium": 0.5, "satisfaction": 70,  "price": 0,   "cat": "fat"},
+    "アブラマシマシ": {"cal": 500,  "sodium": 1.0, "satisfaction": 100, "price": 0,   "cat": "fat"},
+    # ニンニク
+    "ニンニク無し":   {"cal": 0,    "sodium": 0.0, "satisfaction": 0,   "price": 0,   "cat": "garlic"},
+    "ニンニク少なめ": {"cal": 5,    "sodium": 0.0, "satisfaction": 20,  "price": 0,   "cat": "garlic"},
+    "ニンニク普通":   {"cal": 20,   "sodium": 0.0, "satisfaction": 50,  "price": 0,   "cat": "garlic"},
+    "ニンニク増し":   {"cal": 40,   "sodium": 0.0, "satisfaction": 80,  "price": 0,   "cat": "garlic"},
+    # オプション
+    "★スープ完飲(K.K.)": {"cal": 600, "sodium": 8.0, "satisfaction": 120, "price": 0, "cat": "soup_option"},
+    "生卵":              {"cal": 80,   "sodium": 0.0, "satisfaction": 20,  "price": 50,  "cat": "topping"},
+    "うずら(5個)":       {"cal": 100,  "sodium": 0.5, "satisfaction": 30,  "price": 150, "cat": "topping"},
+}
+
+item_tags = {
+    "麺通常(300g)": ["high_carb"],
+    "麺半分(150g)": ["low_carb"],
+    "アブラマシ": ["high_fat"], "アブラマシマシ": ["high_fat"],
+    "ヤサイマシ": ["volumey_vege"], "ヤサイマシマシ": ["volumey_vege"],
+}
+
+INTERACTIONS_PATH = os.environ.get("JIRO_INTERACTIONS")
+INTERACTIONS = load_interactions(INTERACTIONS_PATH) if INTERACTIONS_PATH else DEFAULT_INTERACTIONS
+
+DEFAULT_SHOP = "default"
+DEFAULT_CATALOG = Catalog.from_items_data(DEFAULT_SHOP, items_data, item_tags, INTERACTIONS)
+
+# --- 外部カタログ読み込み ---
+
+def load_catalogs(path):
+    # ファイルの更新時刻もキーにして、同じファイルは1プロセス1回だけパースする
+    stat = os.stat(path)
+    return _load_catalogs(path, stat.st_mtime_ns, stat.st_size)
+
+@functools.lru_cache(maxsize=8)
+def _load_catalogs(path, mtime_ns, size):
+    import pandas as pd
+    df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+    return {str(shop_id): Catalog.from_frame(str(shop_id), group, INTERACTIONS) for shop_id, group in df.groupby("shop_id", sort=False)}
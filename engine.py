@@ -0,0 +1,721 @@
+import collections
+import concurrent.futures
+import contextlib
+import functools
+import itertools
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from catalog import DEFAULT_CATALOG
+
+# Streamlitに依存しない最適化エンジン (app.py / batch.py から共通利用)
+# neal / pyqubo は読み込みが重いので、QUBOを実際に組むときに初めてimportする (厳密解だけなら不要)
+
+# リミット入力の上限 (QUBOのスラック幅もこれに合わせる)
+LIMIT_MAX = {"price": 2500, "cal": 3000, "sodium": 15.0}
+
+@contextlib.contextmanager
+def timed(timings, stage):
+    # ステージ別の計測 (timings が None なら何もしない。同じステージは加算)
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None: timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - t0
+
+# --- スコア計算 ---
+
+def calculate_details(selected_items, weights, catalog=DEFAULT_CATALOG):
+    idx = [catalog.index_of[n] for n in selected_items]
+    total_cal = int(catalog.cal[idx].sum())
+    total_sodium = float(catalog.sodium[idx].sum())
+    total_price = int(catalog.price[idx].sum())
+
+    w = np.array([weights.get(weight_key(catalog.categories[i]), 1.0) for i in idx])
+    weighted_satisfaction = float((catalog.satisfaction[idx] * w).sum())
+
+    # 相互作用はQUBO・一括評価と同じ疎行列から (ルールのラベル → 加点/減点)
+    x = np.zeros((1, catalog.num_items), dtype=np.int8)
+    x[0, idx] = 1
+    terms = interaction_terms(x, catalog)[0]
+    interactions = {rule["label"]: float(v) for rule, v in zip(catalog.interactions, terms) if v != 0}
+
+    final_score = weighted_satisfaction + float(terms.sum())
+    
+    return {
+        "cal": total_cal, "sodium": total_sodium, "price": total_price,
+        "base_sat": weighted_satisfaction, "interactions": interactions, "final_score": final_score
+    }
+
+weight_keys = ["noodle", "pork", "vege", "fat", "garlic", "topping"]
+
+def weight_key(cat):
+    return "topping" if cat in ["soup_option", "topping"] else cat
+
+def weight_vector(weights, catalog):
+    return np.array([weights.get(weight_key(cat), 1.0) for cat in catalog.categories])
+
+# 全列挙インデックスのメモリ上限 (これを超える店舗は分枝限定法・SAで解く)
+MAX_INDEX_BYTES = int(os.environ.get("JIRO_MAX_INDEX_MB", 256)) * 2**20
+
+def order_columns(catalog=DEFAULT_CATALOG):
+    # オーダーを列に分ける: オプションごとの有無 ([-1: 無し, 品目]) → 必須カテゴリごとの1品。各オーダーは列ごとの候補番号で表す
+    return [np.array([-1, i]) for i in catalog.opt_index] + [catalog.cat_index[c] for c in catalog.target_categories]
+
+def index_bytes(catalog=DEFAULT_CATALOG):
+    # OrderIndex の見積もり: 候補番号 (1列1〜2byte) + リソース・ソート順 (int32×9) + 相互作用とスコアキャッシュ (float64)
+    columns = order_columns(catalog)
+    choice = 1 if max(len(c) for c in columns) <= 256 else 2
+    return catalog.order_count() * (len(columns) * choice + 9 * 4 + 8 * (1 + SCORE_CACHE_SIZE))
+
+def enumerable(catalog=DEFAULT_CATALOG):
+    return index_bytes(catalog) <= MAX_INDEX_BYTES
+
+def enumerate_choices(catalog=DEFAULT_CATALOG):
+    # 全オーダー列挙 (注文数×列 の候補番号、先頭の列ほどゆっくり変わる)。品目の0/1行列は作らない
+    if not enumerable(catalog):
+        raise ValueError(f"{catalog.shop_id}: 全{catalog.order_count()}オーダーのインデックス ({index_bytes(catalog) / 2**20:.0f}MB) は上限 {MAX_INDEX_BYTES / 2**20:.0f}MB を超えています")
+    sizes = [len(c) for c in order_columns(catalog)]
+    n = catalog.order_count()
+    choice = np.empty((n, len(sizes)), dtype=np.uint8 if max(sizes) <= 256 else np.uint16)
+    stride = n
+    for k, size in enumerate(sizes):
+        stride //= size
+        choice[:, k] = np.tile(np.repeat(np.arange(size, dtype=choice.dtype), stride), n // (size * stride))
+    return choice
+
+# リソース列の並び (塩分はQUBOと同じ0.1g単位の整数で扱う)
+resource_keys = ["sodium", "cal", "price"]
+
+def limit_vector(limits):
+    return np.array([int(limits["sodium"] * 10), limits["cal"], limits["price"]], dtype=np.int64)
+
+def interaction_score(X, catalog=DEFAULT_CATALOG):
+    # xᵀQx を全行まとめて (Q は品目ペアの疎な係数)
+    return (X[:, catalog.pair_i] * X[:, catalog.pair_j]) @ catalog.pair_coef
+
+def interaction_terms(X, catalog=DEFAULT_CATALOG):
+    # xᵀQx のルール別内訳 (行: オーダー, 列: catalog.interactions)
+    return (X[:, catalog.pair_i] * X[:, catalog.pair_j]) @ catalog.pair_rule
+
+def score_orders(X, weights, catalog=DEFAULT_CATALOG):
+    # x·s_w + xᵀQx (X: 注文数×品目数 の0/1行列)
+    return X @ (catalog.satisfaction * weight_vector(weights, catalog)) + interaction_score(X, catalog)
+
+def evaluate_orders(X, weights, limits, catalog=DEFAULT_CATALOG):
+    # 満足度 (相互作用込み)・リソース超過量を一括計算
+    score = score_orders(X, weights, catalog)
+    over = np.maximum(X @ catalog.resources - limit_vector(limits), 0)
+    return score, over
+
+def plans_from_rows(X, energy, mask, weights, top_k, catalog=DEFAULT_CATALOG):
+    # エネルギー上位top_k件だけdictに変換
+    idx = np.flatnonzero(mask)
+    idx = idx[np.argsort(energy[idx], kind="stable")[:top_k]]
+    plans = []
+    for r in idx:
+        sample_dict = {f"x[{i}]": int(v) for i, v in enumerate(X[r])}
+        sel_items = [catalog.item_names[i] for i in np.flatnonzero(X[r])]
+        plans.append({"sample": sample_dict, "stats": calculate_details(sel_items, weights, catalog), "energy": float(energy[r])})
+    return plans
+
+# --- 実行可能オーダーインデックス ---
+
+UNBOUNDED = 10**9
+
+class OrderIndex:
+    # 各オーダーのリソース量は重みに依存しないので、全オーダーを1回だけ列挙して列指向で保持する
+    # 保持するのは列ごとの候補番号だけで、リソース・満足度は 列ごとの表を候補番号で引いた和 で出す
+    def __init__(self, catalog=DEFAULT_CATALOG):
+        self.catalog = catalog
+        self.columns = order_columns(catalog)
+        self.choice = enumerate_choices(catalog)
+        self.resources = self.column_sum(catalog.resources, np.int32)
+        self.sorted_idx = {k: np.argsort(self.resources[:, j], kind="stable").astype(np.int32) for j, k in enumerate(resource_keys)}
+        self.sorted_vals = {k: self.resources[self.sorted_idx[k], j] for j, k in enumerate(resource_keys)}
+        self.weight_keys = list(dict.fromkeys(weight_key(cat) for cat in catalog.categories))
+
+        # 相互作用: 列の組ごとに (候補 × 候補) の係数表を作り、1回ずつ引く (同じ列の2品は同時に頼めない)
+        col_of = {int(i): (k, p) for k, items in enumerate(self.columns) for p, i in enumerate(items) if i >= 0}
+        tables = {}
+        for i, j, coef in zip(catalog.pair_i.tolist(), catalog.pair_j.tolist(), catalog.pair_coef.tolist()):
+            (ci, pi), (cj, pj) = sorted([col_of[i], col_of[j]])
+            if ci == cj: continue
+            tables.setdefault((ci, cj), np.zeros((len(self.columns[ci]), len(self.columns[cj]))))[pi, pj] += coef
+        self.interaction = np.zeros(len(self))
+        for (ci, cj), table in tables.items(): self.interaction += table[self.choice[:, ci], self.choice[:, cj]]
+        # 重み → スコア列のキャッシュはインスタンスごと (インデックスと一緒に捨てられる)
+        self.score_cache = collections.OrderedDict()
+        self.score_lock = threading.Lock()
+
+    def column_sum(self, values, dtype):
+        # values: 品目ごとの値。候補 -1 (無し) は末尾に足した0行を引く
+        padded = np.concatenate([values, np.zeros((1,) + values.shape[1:], dtype=values.dtype)])
+        total = np.zeros((len(self),) + values.shape[1:], dtype=dtype)
+        for k, items in enumerate(self.columns): total += padded[items][self.choice[:, k]]
+        return total
+
+    def rows(self, idx):
+        # 指定したオーダーだけ品目の0/1行列に戻す
+        idx = np.asarray(idx, dtype=np.intp)
+        X = np.zeros((len(idx), self.catalog.num_items), dtype=np.int8)
+        for k, items in enumerate(self.columns):
+            picked = items[self.choice[idx, k]]
+            X[np.flatnonzero(picked >= 0), picked[picked >= 0]] = 1
+        return X
+
+    @property
+    def nbytes(self):
+        # 配列の合計 + スコアキャッシュが満杯になったときの分
+        arrays = [self.choice, self.resources, self.interaction, *self.sorted_idx.values(), *self.sorted_vals.values()]
+        return sum(a.nbytes for a in arrays) + SCORE_CACHE_SIZE * len(self) * 8
+
+    def __len__(self):
+        return len(self.choice)
+
+    def scores(self, weights):
+        # スライダー操作中は同じ重みで何度も呼ばれるのでキャッシュ
+        w = tuple(weights.get(k, 1.0) for k in self.weight_keys)
+        with self.score_lock:
+            if w in self.score_cache:
+                self.score_cache.move_to_end(w)
+                return self.score_cache[w]
+        gain = self.catalog.satisfaction * weight_vector(dict(zip(self.weight_keys, w)), self.catalog)
+        score = self.column_sum(gain, float) + self.interaction
+        with self.score_lock:
+            self.score_cache[w] = score
+            while len(self.score_cache) > SCORE_CACHE_SIZE: self.score_cache.popitem(last=False)
+        return score
+
+    def over(self, limits):
+        return np.maximum(self.resources - limit_vector(limits), 0)
+
+    def within(self, limits):
+        # 最も絞り込めるリソースで二分探索し、残りはその候補だけマスクで判定 (limitsに無いリソースは無制限)
+        lim_vec = limit_vector({k: limits.get(k, UNBOUNDED) for k in resource_keys})
+        lims = dict(zip(resource_keys, lim_vec))
+        counts = {k: np.searchsorted(self.sorted_vals[k], lims[k], side="right") for k in resource_keys}
+        key = min(counts, key=counts.get)
+        cand = self.sorted_idx[key][:counts[key]]
+        mask = (self.resources[cand] <= lim_vec).all(axis=1)
+        return np.sort(cand[mask])
+
+    def pareto_front(self, weights, resource, candidates=None):
+        # 満足度 vs リソース のパレートフロンティア (リソース昇順のインデックス)
+        score = self.scores(weights)
+        order = self.sorted_idx[resource]
+        if candidates is not None:
+            keep = np.zeros(len(self), dtype=bool)
+            keep[candidates] = True
+            order = order[keep[order]]
+        if len(order) == 0: return order
+
+        s = score[order]
+        front = order[s > np.concatenate(([-np.inf], np.maximum.accumulate(s)[:-1]))]
+        # 同じリソース量の点は最後(最高スコア)だけ残す
+        r = self.resources[front, resource_keys.index(resource)]
+        return front[np.append(r[1:] != r[:-1], True)]
+
+# 店舗ごとのキャッシュ (カタログの内容ハッシュがキー)
+CATALOG_CACHE_SIZE = 256
+# インデックスは1つで数百MBになりうるので、件数ではなく合計バイト数で上限を決める (最後に使った1つは常に残す)
+ORDER_INDEX_CACHE_BYTES = int(os.environ.get("JIRO_ORDER_INDEX_CACHE_MB", 1024)) * 2**20
+SCORE_CACHE_SIZE = 8
+_order_indexes = collections.OrderedDict()
+_order_indexes_lock = threading.Lock()
+
+def get_order_index(catalog=DEFAULT_CATALOG):
+    with _order_indexes_lock:
+        if catalog in _order_indexes:
+            _order_indexes.move_to_end(catalog)
+            return _order_indexes[catalog]
+    index = OrderIndex(catalog)
+    with _order_indexes_lock:
+        index = _order_indexes.setdefault(catalog, index)
+        _order_indexes.move_to_end(catalog)
+        total = sum(ix.nbytes for ix in _order_indexes.values())
+        while total > ORDER_INDEX_CACHE_BYTES and len(_order_indexes) > 1:
+            total -= _order_indexes.popitem(last=False)[1].nbytes
+    return index
+
+def plans_from_index(index, energy, mask, weights, top_k):
+    # 上位top_k件だけ0/1行に戻してからdictに変換
+    idx = np.flatnonzero(mask)
+    idx = idx[np.argsort(energy[idx], kind="stable")[:top_k]]
+    return plans_from_rows(index.rows(idx), energy[idx], np.ones(len(idx), dtype=bool), weights, top_k, index.catalog)
+
+def solve_exact(weights, limits, top_k=3, catalog=DEFAULT_CATALOG):
+    timings = {}
+    with timed(timings, "index"):
+        index = get_order_index(catalog)
+    with timed(timings, "evaluate"):
+        score, over = index.scores(weights), index.over(limits)
+        energy = -score + 5000.0 * (over**2).sum(axis=1)
+        feasible = (over == 0).all(axis=1)
+    with timed(timings, "validation"):
+        valid_plans, compromise_plans = plans_from_index(index, energy, feasible, weights, top_k), plans_from_index(index, energy, ~feasible, weights, top_k)
+
+    return valid_plans, compromise_plans, {"orders": len(index), "feasible": int(feasible.sum()), "timings": timings}
+
+# --- 分枝限定法 (多様な上位k件) ---
+
+# プラン同士の違いを数えるカテゴリ (カタログに無いものは無視、1つも無ければ全カテゴリ)
+DIVERSE_CATEGORIES = ["vege", "fat", "garlic"]
+
+class PlanSearch:
+    # カテゴリごとに1品 → オプションの有無 の順に分岐する深さ優先探索 (全列挙しないので大きい店舗でも使える)
+    #   資源: 確定分 + 残りカテゴリの最小量 がリミットを超えたら枝刈り
+    #   上界: 確定分のスコア + 残りカテゴリの最大楽観値 + オプションの分数ナップサック (資源ごとに解いた最小)
+    #   多様性: 採用済みの各プランと、残りの多様性カテゴリを全部変えても min_diff に届かなければ枝刈り
+    def __init__(self, weights, limits, catalog=DEFAULT_CATALOG, diverse_categories=DIVERSE_CATEGORIES):
+        self.catalog = catalog
+        self.gain = (catalog.satisfaction * weight_vector(weights, catalog)).tolist()
+        self.adj = [[] for _ in range(catalog.num_items)]
+        for i, j, c in zip(catalog.pair_i.tolist(), catalog.pair_j.tolist(), catalog.pair_coef.tolist()):
+            self.adj[i].append((j, c))
+            self.adj[j].append((i, c))
+        # 楽観値: 正の相互作用をすべて受け取った場合の寄与 (負の相互作用は無視するので上界になる)
+        self.optimistic = [g + sum(max(c, 0.0) for _, c in a) for g, a in zip(self.gain, self.adj)]
+        self.res = [tuple(r) for r in catalog.resources.tolist()]
+        self.limit = tuple(limit_vector(limits).tolist())
+
+        # 多様性カテゴリを先に決めると、違いが足りない枝を浅いところで切れる
+        cats = sorted(catalog.target_categories, key=lambda c: c not in diverse_categories)
+        self.num_diverse = sum(c in diverse_categories for c in cats) or len(cats)
+        self.levels = [sorted(catalog.cat_index[c].tolist(), key=lambda i: -self.optimistic[i]) for c in cats]
+        self.opts = sorted(catalog.opt_index.tolist(), key=lambda i: -self.optimistic[i])
+        n = len(self.levels)
+        self.rest_min = [tuple(sum(min(self.res[i][r] for i in lv) for lv in self.levels[l:]) for r in range(len(resource_keys))) for l in range(n + 1)]
+        self.rest_max = [sum(max(self.optimistic[i] for i in lv) for lv in self.levels[l:]) for l in range(n + 1)]
+        # 残りオプション (opts[s:]) の 資源ごとに 楽観値/資源量 の高い順
+        self.opt_sorted = [[sorted(((self.res[i][r], self.optimistic[i]) for i in self.opts[s:] if self.optimistic[i] > 0), key=lambda wv: -wv[1] / wv[0] if wv[0] else -math.inf)
+                            for r in range(len(resource_keys))] for s in range(len(self.opts) + 1)]
+
+    def opt_bound(self, s, cap):
+        bound = math.inf
+        for items, c in zip(self.opt_sorted[s], cap):
+            total = 0.0
+            for w, v in items:
+                if w <= c:
+                    total += v
+                    c -= w
+                else:
+                    total += v * c / w
+                    break
+            bound = min(bound, total)
+        return bound
+
+    def best(self, chosen=(), min_diff=1, stats=None):
+        # chosen: 採用済みプランの品目リスト (探索順)。どれとも多様性カテゴリで min_diff 以上違う最良のオーダー (無ければ None)
+        stats = stats if stats is not None else dict.fromkeys(["explored", "resource", "bound", "diversity"], 0)
+        n_cat, n_levels = len(self.levels), len(self.levels) + len(self.opts)
+        selected = [False] * self.catalog.num_items
+        picks, found = [], [-math.inf, None]
+
+        def visit(level, score, used, diffs):
+            rest = self.rest_min[min(level, n_cat)]
+            cap = tuple(lim - u - m for lim, u, m in zip(self.limit, used, rest))
+            if min(cap) < 0:
+                stats["resource"] += 1; return
+            if any(d + max(self.num_diverse - level, 0) < min_diff for d in diffs):
+                stats["diversity"] += 1; return
+            if score + self.rest_max[min(level, n_cat)] + self.opt_bound(max(level - n_cat, 0), cap) <= found[0]:
+                stats["bound"] += 1; return
+            stats["explored"] += 1
+            if level == n_levels:
+                # min_diff=0 でも同じオーダーは2度採らない
+                if picks in chosen: stats["diversity"] += 1
+                else: found[:] = [score, list(picks)]
+                return
+            if level < n_cat: branches = [(i, True) for i in self.levels[level]]
+            else: branches = [(self.opts[level - n_cat], True), (self.opts[level - n_cat], False)]
+            for i, take in branches:
+                if not take:
+                    visit(level + 1, score, used, diffs); continue
+                delta = self.gain[i] + sum(c for j, c in self.adj[i] if selected[j])
+                next_diffs = [d + (i != prev[level]) for d, prev in zip(diffs, chosen)] if level < self.num_diverse else diffs
+                selected[i] = True; picks.append(i)
+                visit(level + 1, score + delta, tuple(u + r for u, r in zip(used, self.res[i])), next_diffs)
+                selected[i] = False; picks.pop()
+
+        visit(0, 0.0, (0,) * len(resource_keys), [0] * len(chosen))
+        return found[1]
+
+def solve_branch_and_bound(weights, limits, top_k=3, min_diff=1, catalog=DEFAULT_CATALOG):
+    # 上位k件を1件ずつ: 2件目以降は採用済みのプランすべてと min_diff カテゴリ以上違うものの中で厳密に最良
+    timings = {}
+    stats = dict.fromkeys(["explored", "resource", "bound", "diversity"], 0)
+    with timed(timings, "index"):
+        search = PlanSearch(weights, limits, catalog)
+    chosen = []
+    with timed(timings, "search"):
+        while len(chosen) < top_k:
+            picks = search.best(chosen, min_diff, stats)
+            if picks is None: break
+            chosen.append(picks)
+    with timed(timings, "validation"):
+        X = np.zeros((len(chosen), catalog.num_items), dtype=np.int8)
+        for r, picks in enumerate(chosen): X[r, picks] = 1
+        valid_plans = plans_from_rows(X, -score_orders(X, weights, catalog), np.ones(len(X), dtype=bool), weights, top_k, catalog)
+    # リミット内が1件も無いときの妥協案は全列挙できる店舗だけ
+    compromise_plans = [] if valid_plans or not enumerable(catalog) else solve_exact(weights, limits, top_k, catalog)[1]
+    pruned = {k: stats[k] for k in ("resource", "bound", "diversity")}
+    return valid_plans, compromise_plans, {"orders": catalog.order_count(), "nodes": stats["explored"], "pruned": sum(pruned.values()), "pruned_by": pruned,
+                                           "min_diff": min_diff, "timings": timings}
+
+# 制約エンコード: 単位 (カロリーkcal / 価格円 / 塩分g) ごとの換算幅
+QUBO_ENCODINGS = {"log": "LogEncスラック (標準)", "scaled": "粗視化単位 + LogEncスラック", "unbalanced": "Unbalancedペナルティ (スラック無し)"}
+QUBO_UNITS = {
+    "log": {"cal": 1, "price": 1, "sodium": 0.1},
+    "scaled": {"cal": 10, "price": 50, "sodium": 0.1},
+    "unbalanced": {"cal": 10, "price": 50, "sodium": 0.1},
+}
+# Unbalanced: (λ1, λ2) で S*(λ2*u^2 - λ1*u) (u = (リミット - 合計) / 最大リソース、S = 品目の最大満足度)
+# Mは掛けない (リミット内側の余りへのペナルティを目的関数より十分小さくする)
+UNBALANCED_LAMBDA = (5.0, 20.0)
+# 制約項 (リミット・各カテゴリ1品) の重み M。Placeholderなのでコンパイルし直さずに変えられる
+CONSTRAINT_STRENGTH = 5000.0
+
+def to_units(value, unit, round_up=True):
+    v = round(value / unit, 6)
+    return math.ceil(v) if round_up else math.floor(v)
+
+@functools.lru_cache(maxsize=CATALOG_CACHE_SIZE)
+def compile_qubo_model(catalog=DEFAULT_CATALOG, encoding="log"):
+    # 重み・リミットはPlaceholderにしてコンパイルは店舗×エンコードごとに1回だけ
+    # スラックは1オーダーの最大リソースに合わせた固定幅 (リミットもそこで頭打ちにするので s = limit - 合計 <= 最大 で実行可能域は変わらない)
+    from pyqubo import Array, Constraint, LogEncInteger, Placeholder
+    t0 = time.perf_counter()
+    x = Array.create('x', shape=catalog.num_items, vartype='BINARY')
+    w = {k: Placeholder(f"w_{k}") for k in dict.fromkeys(weight_key(cat) for cat in catalog.categories)}
+    H_obj = 0
+    for i in range(catalog.num_items):
+        H_obj += -1 * float(catalog.satisfaction[i]) * w[weight_key(catalog.categories[i])] * x[i]
+
+    # 相互作用: カタログの疎行列 Q から2次項を生成 (エネルギーは満足度の符号反転)
+    H_interaction = 0
+    for i, j, coef in zip(catalog.pair_i, catalog.pair_j, catalog.pair_coef):
+        H_interaction += -float(coef) * x[int(i)] * x[int(j)]
+
+    # リミット制約: 単位換算した整数係数 (品目側は切り上げ、リミット側は切り捨てで安全側に丸める)
+    units = QUBO_UNITS[encoding]
+    values = {"sodium": catalog.sodium, "cal": catalog.cal, "price": catalog.price}
+    top = max_limits(catalog)
+    H_limits, H_unbalanced = 0, 0
+    scale = float(np.abs(catalog.satisfaction).max())
+    for key, label in [("sodium", "Sodium"), ("cal", "Calorie"), ("price", "Price")]:
+        curr = sum(to_units(float(values[key][i]), units[key]) * x[i] for i in range(catalog.num_items))
+        lim = Placeholder(f"lim_{key}")
+        if encoding == "unbalanced":
+            # スラック無し: h = lim - curr の2次式で超過側を重く罰する (Unbalanced penalization)
+            u = (lim - curr) / max(to_units(top[key], units[key]), 1)
+            H_unbalanced += Constraint(scale * (UNBALANCED_LAMBDA[1] * u**2 - UNBALANCED_LAMBDA[0] * u), label=label)
+        else:
+            s_key = LogEncInteger(f"s_{key}", (0, max(to_units(top[key], units[key]), 1)))
+            H_limits += Constraint((curr + s_key - lim)**2, label=label)
+    
+    H_exclusive = 0
+    for cat in catalog.target_categories:
+        H_exclusive += Constraint((sum(x[int(i)] for i in catalog.cat_index[cat]) - 1)**2, label=f"OneHot_{cat}")
+
+    M = Placeholder("M")
+    H = H_obj + H_interaction + M*(H_limits + H_exclusive) + H_unbalanced
+    t1 = time.perf_counter()
+    model = H.compile()
+    
+    # セッション間で共有するため、BQM生成はロックで直列化
+    return model, threading.Lock(), {"expression": t1 - t0, "compile": time.perf_counter() - t1}
+
+def max_limits(catalog):
+    # これ以上のリミットはどのオーダーにも効かない
+    top = dict(zip(resource_keys, catalog.max_resources.tolist()))
+    return {**top, "sodium": top["sodium"] / 10}
+
+def qubo_feed_dict(weights, limits, encoding="log", catalog=DEFAULT_CATALOG, strength=CONSTRAINT_STRENGTH):
+    top = max_limits(catalog)
+    feed_dict = {"M": strength}
+    feed_dict.update({f"w_{k}": weights.get(k, 1.0) for k in dict.fromkeys(weight_key(cat) for cat in catalog.categories)})
+    feed_dict.update({f"lim_{k}": to_units(min(v, top[k]), QUBO_UNITS[encoding][k], round_up=False) for k, v in limits.items()})
+    return feed_dict
+
+def build_bqm(weights, limits, encoding="log", catalog=DEFAULT_CATALOG, strength=CONSTRAINT_STRENGTH, timings=None):
+    # timings: 式の構築・コンパイルはキャッシュに無かった (この呼び出しでコンパイルした) ときだけ記録
+    misses = compile_qubo_model.cache_info().misses
+    model, model_lock, compile_times = compile_qubo_model(catalog, encoding)
+    if timings is not None and compile_qubo_model.cache_info().misses > misses:
+        for stage, sec in compile_times.items(): timings[stage] = timings.get(stage, 0.0) + sec
+    feed_dict = qubo_feed_dict(weights, limits, encoding, catalog, strength)
+    with timed(timings, "to_bqm"), model_lock:
+        bqm = model.to_bqm(feed_dict=feed_dict)
+    return model, bqm, feed_dict
+
+# ウォームスタート用に次の求解へ引き継ぐ低エネルギーサンプル数
+WARM_STATES = 50
+
+@functools.lru_cache(maxsize=CATALOG_CACHE_SIZE)
+def base_bqm_size(catalog=DEFAULT_CATALOG):
+    # 標準エンコードのBQMサイズ (スラック幅はカタログだけで決まるので、重み・リミットは何でもよい)
+    bqm = build_bqm({}, max_limits(catalog), "log", catalog)[1]
+    return len(bqm.variables), len(bqm.quadratic)
+
+def bqm_info(bqm, weights, limits, encoding, catalog=DEFAULT_CATALOG):
+    # 標準エンコードとのBQMサイズ比較
+    base_vars, base_interactions = (len(bqm.variables), len(bqm.quadratic)) if encoding == "log" else base_bqm_size(catalog)
+    return {
+        "encoding": encoding,
+        "bqm_vars": len(bqm.variables), "bqm_interactions": len(bqm.quadratic),
+        "base_vars": base_vars, "base_interactions": base_interactions,
+    }
+
+def plans_from_samples(samples, energies, variables, weights, limits, top_k, catalog=DEFAULT_CATALOG, timings=None):
+    # レコード配列から直接後処理: x[i]列だけ抜き出し、低エネルギー順に重複除去
+    # 戻り値の counts: 重複除去後のサンプル数と、そのうち実行可能 (各カテゴリ1品 & リミット内) な数
+    with timed(timings, "decode"):
+        col = {v: k for k, v in enumerate(variables)}
+        order = np.argsort(energies, kind="stable")
+        warm_states = (samples[order[:WARM_STATES]], list(variables))
+        X = samples[:, [col[f"x[{i}]"] for i in range(catalog.num_items)]]
+        _, first = np.unique(X[order], axis=0, return_index=True)
+        rows = order[np.sort(first)]
+        X = X[rows]
+
+    # バリデーション: 各カテゴリ1品 & リミット内
+    with timed(timings, "validation"):
+        one_hot = ((X @ catalog.category_matrix) == 1).all(axis=1)
+        score, over = evaluate_orders(X, weights, limits, catalog)
+        feasible = (over == 0).all(axis=1)
+        # 順位はBQMエネルギーではなく実際のスコア (粗視化の丸めやUnbalancedの残りペナルティで入れ替わらないように)
+        energy = -score + 5000.0 * (over**2).sum(axis=1)
+        valid_plans, compromise_plans = plans_from_rows(X, energy, one_hot & feasible, weights, top_k, catalog), plans_from_rows(X, energy, one_hot & ~feasible, weights, top_k, catalog)
+
+    counts = {"unique": len(rows), "feasible": int((one_hot & feasible).sum())}
+    return valid_plans, compromise_plans, warm_states, counts
+
+def solve_annealing(weights, limits, top_k=3, encoding="log", num_reads=1000, num_sweeps=1000, beta_range=(0.1, 5.0), initial_states=None, catalog=DEFAULT_CATALOG, strength=CONSTRAINT_STRENGTH, seed=None,
+                    batch_reads=100, cancel=None, progress=None):
+    # initial_states: 別のリミットで解いたときの solve_info["states"] (同じエンコードならBQMの変数集合は共通)
+    # 固定スケジュールのまま batch_reads ずつ読み出し、バッチの切れ目で cancel を確認する (progress は適応版と同じ)
+    import neal
+    timings = {}
+    _, bqm, _ = build_bqm(weights, limits, encoding, catalog, strength, timings)
+    sampler = neal.SimulatedAnnealingSampler()
+    samples, energies, variables, stop_reason = [], [], None, "max_reads"
+    while sum(len(e) for e in energies) < num_reads:
+        reads = min(batch_reads, num_reads - sum(len(e) for e in energies))
+        with timed(timings, "sample"):
+            response = sampler.sample(bqm, num_reads=reads, num_sweeps=num_sweeps, beta_range=beta_range, initial_states=initial_states,
+                                      seed=None if seed is None else seed + len(energies))
+        variables = response.variables
+        samples.append(response.record.sample)
+        energies.append(response.record.energy)
+        initial_states = None
+        if progress is not None: progress(sum(len(e) for e in energies), num_reads)
+        if cancel is not None and cancel.is_set():
+            stop_reason = "cancelled"; break
+
+    valid_plans, compromise_plans, warm_states, counts = plans_from_samples(np.vstack(samples), np.concatenate(energies), variables, weights, limits, top_k, catalog, timings)
+    solve_info = bqm_info(bqm, weights, limits, encoding, catalog)
+    solve_info.update({"states": warm_states, "reads": sum(len(e) for e in energies), "sweeps": num_sweeps, "batches": len(energies), "beta_range": beta_range,
+                       "stop_reason": stop_reason, **counts, "timings": timings})
+    return valid_plans, compromise_plans, solve_info
+
+def auto_beta_range(bqm):
+    # 係数の実スケールから逆温度を決める
+    # 高温側: 最大のフリップ差分でも50%で受理 / 低温側: 最小の非ゼロ係数でも1%しか受理しない
+    lin, (row, col, quad), _ = bqm.to_numpy_vectors()
+    flip = np.abs(lin).astype(float)
+    np.add.at(flip, row, np.abs(quad))
+    np.add.at(flip, col, np.abs(quad))
+    coeffs = np.abs(np.concatenate([lin, quad]))
+    min_coeff = coeffs[coeffs > 0].min() if (coeffs > 0).any() else 1.0
+    return (np.log(2) / flip.max(), np.log(100) / min_coeff)
+
+def solve_annealing_adaptive(weights, limits, top_k=3, encoding="log", num_reads=1000, num_sweeps=100, batch_reads=100, patience=3, time_budget=0.3, initial_states=None, catalog=DEFAULT_CATALOG, cancel=None, progress=None, strength=CONSTRAINT_STRENGTH, seed=None):
+    # バッチごとに読み出し、上位top_kの実行可能プランがpatienceバッチ連続で変わらないか、time_budget秒を超えたら打ち切る
+    # num_reads は読み出し数の上限
+    # cancel: threading.Event (セットされたらバッチの切れ目で打ち切り) / progress: progress(読み出し済み, num_reads) を毎バッチ呼ぶ
+    import neal
+    timings = {}
+    _, bqm, _ = build_bqm(weights, limits, encoding, catalog, strength, timings)
+    sampler = neal.SimulatedAnnealingSampler()
+    beta_range = auto_beta_range(bqm)
+
+    samples, energies, variables = [], [], None
+    last_top, stable, stop_reason = None, 0, "max_reads"
+    t_start = time.perf_counter()
+    while sum(len(e) for e in energies) < num_reads:
+        with timed(timings, "sample"):
+            response = sampler.sample(bqm, num_reads=batch_reads, num_sweeps=num_sweeps, beta_range=beta_range, initial_states=initial_states,
+                                      seed=None if seed is None else seed + len(energies))
+        variables = response.variables
+        samples.append(response.record.sample)
+        energies.append(response.record.energy)
+        initial_states = None
+        if progress is not None: progress(sum(len(e) for e in energies), num_reads)
+        if cancel is not None and cancel.is_set():
+            stop_reason = "cancelled"; break
+
+        valid_plans, _, _, _ = plans_from_samples(np.vstack(samples), np.concatenate(energies), variables, weights, limits, top_k, catalog, timings)
+        top = [tuple(p["sample"].values()) for p in valid_plans]
+        stable = stable + 1 if top == last_top else 0
+        last_top = top
+        if stable >= patience:
+            stop_reason = "converged"; break
+        if time.perf_counter() - t_start > time_budget:
+            stop_reason = "time_budget"; break
+
+    reads = sum(len(e) for e in energies)
+    valid_plans, compromise_plans, warm_states, counts = plans_from_samples(np.vstack(samples), np.concatenate(energies), variables, weights, limits, top_k, catalog, timings)
+    solve_info = bqm_info(bqm, weights, limits, encoding, catalog)
+    solve_info.update({"states": warm_states, "reads": reads, "sweeps": num_sweeps, "batches": len(energies), "beta_range": beta_range, "stop_reason": stop_reason,
+                       **counts, "timings": timings})
+    return valid_plans, compromise_plans, solve_info
+
+SOLVERS = {"exact": solve_exact, "bnb": solve_branch_and_bound, "sa": solve_annealing, "sa_adaptive": solve_annealing_adaptive}
+SOLVER_LABELS = {"exact": "厳密解 (Exact)", "bnb": "分枝限定法 (多様な上位k件)", "sa": "Simulated Annealing", "sa_adaptive": "SA (適応スケジュール・早期停止)"}
+ANNEALING_SOLVERS = ["sa", "sa_adaptive"]
+
+# --- リミットスイープ (感度分析) ---
+
+# ウォームスタート時のアニール設定 (隣の格子点の解から再出発するので少ないスイープで足りる)
+WARM_SWEEP_OPTS = {"num_reads": 200, "num_sweeps": 100}
+
+def sweep_chain(weights, budgets, cal_limit, sodium_limit, solver="exact", catalog=DEFAULT_CATALOG, **solver_opts):
+    # 予算方向の1本: SAは1つ前の予算の上位サンプルを initial_states にして少ないスイープで解き直す
+    # 戻り値: (予算ごとの最高スコア (リミット内が無ければnan), 所要秒)
+    best, seconds, states = np.full(len(budgets), np.nan), np.zeros(len(budgets)), None
+    for bi, budget in enumerate(budgets):
+        t = time.perf_counter()
+        limits = {"price": budget, "cal": cal_limit, "sodium": sodium_limit}
+        opts = dict(solver_opts)
+        if solver in ANNEALING_SOLVERS and states is not None: opts.update(WARM_SWEEP_OPTS, initial_states=states)
+        valid_plans, _, solve_info = SOLVERS[solver](weights, limits, top_k=1, catalog=catalog, **opts)
+        states = solve_info.get("states")
+        if valid_plans: best[bi] = valid_plans[0]["stats"]["final_score"]
+        seconds[bi] = time.perf_counter() - t
+    return best, seconds
+
+def sweep_limits(weights, budgets, cal_limits, sodium_limits, solver="exact", workers=None, catalog=DEFAULT_CATALOG, **solver_opts):
+    # (塩分, カロリー) の組ごとに予算方向を1本のチェーンとしてスレッドで並列実行
+    shape = (len(sodium_limits), len(cal_limits), len(budgets))
+    best, seconds = np.full(shape, np.nan), np.zeros(shape)
+
+    def run_chain(si, ci):
+        best[si, ci], seconds[si, ci] = sweep_chain(weights, budgets, cal_limits[ci], sodium_limits[si], solver, catalog, **solver_opts)
+
+    t_start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(lambda args: run_chain(*args), itertools.product(range(shape[0]), range(shape[1]))))
+    return {"best": best, "seconds": seconds, "wall": time.perf_counter() - t_start}
+
+# --- コール生成 ---
+
+def selected_items(sample, catalog=DEFAULT_CATALOG):
+    return [n for idx, n in enumerate(catalog.item_names) if sample.get(f"x[{idx}]") == 1]
+
+def make_call(sel_list, catalog=DEFAULT_CATALOG):
+    sel_vege = next((n for n in sel_list if catalog.item_cat(n) == "vege"), "")
+    sel_garlic = next((n for n in sel_list if catalog.item_cat(n) == "garlic"), "")
+    sel_fat = next((n for n in sel_list if catalog.item_cat(n) == "fat"), "")
+    
+    call_parts = []
+    is_default = ("無し" in sel_garlic and "普通" in sel_vege and ("普通" in sel_fat or "無し" in sel_fat))
+    if is_default: return "そのままで"
+
+    if "少なめ" in sel_garlic: call_parts.append("ニンニク少なめ")
+    elif "普通" in sel_garlic: call_parts.append("ニンニク")
+    elif "増し" in sel_garlic: call_parts.append("ニンニクマシ")
+    
+    if "少なめ" in sel_vege: call_parts.append("ヤサイ少なめ")
+    elif "マシマシ" in sel_vege: call_parts.append("ヤサイマシマシ")
+    elif "マシ" in sel_vege: call_parts.append("ヤサイ")
+    
+    if "マシマシ" in sel_fat: call_parts.append("アブラマシマシ")
+    elif "マシ" in sel_fat: call_parts.append("アブラ")
+
+    return " ".join(call_parts) if call_parts else "そのままで"
+
+# --- 公開API ---
+
+def solve(weights, limits, top_k=3, solver="exact", catalog=DEFAULT_CATALOG, **solver_opts):
+    # limits: {"price": 円, "cal": kcal, "sodium": g}
+    # 制約を満たすプランが無ければ、条件に近いプランを is_approximate=True で返す
+    valid_plans, compromise_plans, solve_info = SOLVERS[solver](weights, limits, top_k=top_k, catalog=catalog, **solver_opts)
+    plans = valid_plans if valid_plans else compromise_plans
+    for plan in plans:
+        plan["items"] = selected_items(plan["sample"], catalog)
+        plan["call"] = make_call(plan["items"], catalog)
+    return {"plans": plans, "is_approximate": not valid_plans, "info": solve_info}
+
+# --- グループ注文 (共有予算) ---
+
+def price_unit(catalog):
+    # 全オーダーの価格はこの単位の倍数 (DPの予算刻み)
+    prices = catalog.price[catalog.price > 0]
+    return int(np.gcd.reduce(prices)) if len(prices) else 1
+
+def allocate_budget(costs, scores, budget_units):
+    # 多選択ナップサック: 各人のフロンティアから1点ずつ選び、合計コスト <= 予算で合計スコア最大
+    # dp[b] = ここまでの人数で コスト合計 b 以下 の最大合計スコア
+    dp = np.zeros(budget_units + 1)
+    choice = np.empty((len(costs), budget_units + 1), dtype=np.int32)
+    for n, (cost, score) in enumerate(zip(costs, scores)):
+        new, arg = np.full(budget_units + 1, -np.inf), np.full(budget_units + 1, -1, dtype=np.int32)
+        for p, (c, sc) in enumerate(zip(cost, score)):
+            if c > budget_units: break
+            cand = np.full(budget_units + 1, -np.inf)
+            cand[c:] = dp[:budget_units + 1 - c] + sc
+            better = cand > new
+            new[better], arg[better] = cand[better], p
+        dp, choice[n] = new, arg
+
+    picks, b = [], budget_units
+    for n in reversed(range(len(costs))):
+        p = int(choice[n, b])
+        picks.append(p)
+        b -= int(costs[n][p])
+    return picks[::-1]
+
+def solve_group(diners, budget, catalog=DEFAULT_CATALOG):
+    # diners: [{"name": 名前, "weights": weights_map, "limits": {"cal": kcal, "sodium": g}}, ...] / budget: 全員の合計予算 (円)
+    # 共有予算で分解する: 各人の (価格 → 最高満足度) パレートフロンティアを全列挙インデックスから厳密に求め、
+    # 予算の配分だけを多選択ナップサックのDPで解く (結合QUBOのような人数に比例したスラックは持たない)
+    timings = {}
+    with timed(timings, "index"):
+        index = get_order_index(catalog)
+    price_col = resource_keys.index("price")
+    unit = price_unit(catalog)
+
+    fronts, approx = [], []
+    with timed(timings, "frontiers"):
+        for d in diners:
+            personal = {k: v for k, v in d["limits"].items() if k != "price"}
+            cand = index.within(personal)
+            approx.append(len(cand) == 0)
+            if len(cand) == 0:
+                # 個人リミットを満たすオーダーが無い人は、超過が最小のオーダー1つだけを候補にする
+                # 価格は共有予算で決めるので、超過は塩分・カロリーだけで測る (limitsに無いリソースは無制限)
+                over = index.over({k: personal.get(k, UNBOUNDED) for k in resource_keys})
+                energy = -index.scores(d["weights"]) + 5000.0 * (over**2).sum(axis=1)
+                cand = np.array([np.argmin(energy)])
+            fronts.append(index.pareto_front(d["weights"], "price", cand))
+    costs = [index.resources[f, price_col] // unit for f in fronts]
+    scores = [index.scores(d["weights"])[f] for d, f in zip(diners, fronts)]
+
+    with timed(timings, "allocate"):
+        budget_units = int(budget // unit)
+        over_budget = sum(int(c[0]) for c in costs) > budget_units
+        # 一番安いオーダーでも予算を超えるなら、全員最安のオーダーにする
+        picks = [0] * len(diners) if over_budget else allocate_budget(costs, scores, budget_units)
+
+    results = []
+    for d, f, p, a in zip(diners, fronts, picks, approx):
+        items = [catalog.item_names[i] for i in np.flatnonzero(index.rows([f[p]])[0])]
+        results.append({"name": d["name"], "items": items, "call": make_call(items, catalog), "stats": calculate_details(items, d["weights"], catalog), "is_approximate": a})
+    total = {"price": sum(r["stats"]["price"] for r in results), "final_score": sum(r["stats"]["final_score"] for r in results)}
+    info = {"diners": len(diners), "frontier_points": sum(len(f) for f in fronts), "price_unit": unit, "timings": timings}
+    return {"diners": results, "total": total, "budget": budget, "is_approximate": over_budget or any(approx), "info": info}
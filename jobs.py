@@ -0,0 +1,140 @@
+import concurrent.futures
+import functools
+import itertools
+import os
+import threading
+import time
+
+from catalog import DEFAULT_CATALOG
+from engine import solve
+from metrics import get_metrics
+from result_cache import get_result_cache, result_key
+
+# プロセス全体で共有するソルバー実行キュー
+# Streamlitの各セッションはここにジョブを投げてポーリングする (スクリプトスレッドはブロックしない)
+SOLVE_WORKERS = int(os.environ.get("JIRO_SOLVE_WORKERS", os.cpu_count() or 1))
+MAX_PENDING_JOBS = int(os.environ.get("JIRO_MAX_PENDING_JOBS", 4 * SOLVE_WORKERS))
+# バッチの切れ目で途中キャンセル・進捗報告できるソルバー
+CANCELLABLE_SOLVERS = ["sa", "sa_adaptive"]
+
+class SolverBusy(RuntimeError):
+    pass
+
+class QueuedJob:
+    # キューで実行する計算の共通部分 (状態・待機・経過時間)。execute() をサブクラスで実装する
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.cancel_event = threading.Event()
+        self.submitted_at, self.started_at, self.finished_at = time.perf_counter(), None, None
+        self.future = None
+
+    def run(self):
+        self.started_at = time.perf_counter()
+        try:
+            return self.execute()
+        finally:
+            self.finished_at = time.perf_counter()
+
+    def cancel(self):
+        # 待機中ならキューから外し、実行中ならキャンセル対応ソルバーに打ち切りを伝える
+        self.cancel_event.set()
+        self.future.cancel()
+
+    @property
+    def status(self):
+        if self.future.cancelled() or (self.cancel_event.is_set() and self.future.done()): return "cancelled"
+        if self.future.done(): return "failed" if self.future.exception() is not None else "done"
+        return "running" if self.started_at is not None else "queued"
+
+    def wait(self, timeout):
+        concurrent.futures.wait([self.future], timeout=timeout)
+        return self.future.done()
+
+    def result(self):
+        return self.future.result()
+
+    def elapsed(self):
+        return (self.finished_at or time.perf_counter()) - (self.started_at or self.submitted_at)
+
+class SolveJob(QueuedJob):
+    def __init__(self, job_id, weights, limits, top_k, solver, catalog, solver_opts):
+        super().__init__(job_id)
+        self.weights, self.limits, self.top_k, self.solver, self.catalog, self.solver_opts = weights, limits, top_k, solver, catalog, solver_opts
+        self.progress = None
+        self.cached = False
+
+    def execute(self):
+        opts = dict(self.solver_opts)
+        if self.solver in CANCELLABLE_SOLVERS:
+            opts.update(cancel=self.cancel_event, progress=self._report)
+        result = solve(self.weights, self.limits, top_k=self.top_k, solver=self.solver, catalog=self.catalog, **opts)
+        get_metrics().observe_solve(self.solver, result["info"], time.perf_counter() - self.started_at, queue_wait=self.started_at - self.submitted_at)
+        return result
+
+    def _report(self, done, total):
+        self.progress = (done, total)
+
+class TaskJob(QueuedJob):
+    # solve() 以外の重い計算 (リミットスイープ・グループ最適化) も同じワーカー数の枠で動かす
+    def __init__(self, job_id, fn, args, kwargs):
+        super().__init__(job_id)
+        self.fn, self.args, self.kwargs = fn, args, kwargs
+
+    def execute(self):
+        return self.fn(*self.args, **self.kwargs)
+
+class SolveQueue:
+    def __init__(self, workers=SOLVE_WORKERS, max_pending=MAX_PENDING_JOBS, cache=None):
+        self.workers, self.max_pending = workers, max_pending
+        self.cache = cache if cache is not None else get_result_cache()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="solve")
+        self.lock = threading.Lock()
+        self.active = {}
+        self.ids = itertools.count(1)
+
+    def submit(self, weights, limits, top_k=3, solver="exact", catalog=DEFAULT_CATALOG, **solver_opts):
+        # キャッシュにあればサンプリングせず、完了済みのジョブとして返す (キューの上限にも数えない)
+        key = result_key(weights, limits, top_k, solver, catalog, solver_opts)
+        cached = self.cache.get(key) if key is not None else None
+        if cached is not None:
+            job = SolveJob(0, dict(weights), dict(limits), top_k, solver, catalog, solver_opts)
+            job.cached, job.started_at, job.finished_at = True, job.submitted_at, job.submitted_at
+            job.future = concurrent.futures.Future()
+            job.future.set_result(cached)
+            get_metrics().observe_solve(solver, cached["info"], 0.0, cached=True)
+            return job
+
+        return self._enqueue(lambda job_id: SolveJob(job_id, dict(weights), dict(limits), top_k, solver, catalog, solver_opts), key)
+
+    def submit_task(self, fn, *args, **kwargs):
+        # 任意の計算をキューに載せる (結果はキャッシュしない)
+        return self._enqueue(lambda job_id: TaskJob(job_id, fn, args, kwargs))
+
+    def _enqueue(self, make_job, key=None):
+        # 実行中 + 待機中が上限に達していたら受け付けない (待ち時間を予測可能に保つ)
+        with self.lock:
+            if len(self.active) >= self.max_pending:
+                raise SolverBusy(f"solve queue is full ({len(self.active)}/{self.max_pending})")
+            job = make_job(next(self.ids))
+            self.active[job.job_id] = job
+            job.future = self.pool.submit(job.run)
+        job.future.add_done_callback(lambda _: self._release(job, key))
+        return job
+
+    def _release(self, job, key):
+        with self.lock:
+            self.active.pop(job.job_id, None)
+        if key is not None and job.status == "done" and job.result()["info"].get("stop_reason") != "cancelled":
+            self.cache.put(key, job.result())
+
+    def depth(self):
+        return len(self.active)
+
+    def position(self, job):
+        # 自分より先に投入されて、まだ始まっていないジョブの数
+        with self.lock:
+            return sum(1 for j in self.active.values() if j.job_id < job.job_id and j.started_at is None)
+
+@functools.lru_cache(maxsize=None)
+def get_solve_queue():
+    return SolveQueue()
@@ -0,0 +1,108 @@
+import bisect
+import collections
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+# Solve経路のステージ別計測の集計と書き出し
+#   JSONログ: 1 solve / 1 描画ごとに1行 (JIRO_METRICS_LOG にパス、省略時は標準エラー、"off" で無効)
+#   Prometheus: テキスト形式のメトリクスファイル (JIRO_METRICS_PATH を指定したときだけ、node_exporter の textfile collector 向け)
+METRICS_LOG = os.environ.get("JIRO_METRICS_LOG", "-")
+METRICS_PATH = os.environ.get("JIRO_METRICS_PATH")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def metrics_logger(target=METRICS_LOG):
+    logger = logging.getLogger("jiro.metrics")
+    if not logger.handlers:
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        if target == "off": logger.addHandler(logging.NullHandler())
+        else:
+            handler = logging.StreamHandler(sys.stderr) if target == "-" else logging.FileHandler(target, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            logger.addHandler(handler)
+    return logger
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metrics:
+    def __init__(self, path=METRICS_PATH, logger=None):
+        self.path = path
+        self.logger = logger or metrics_logger()
+        self.lock = threading.Lock()
+        # (ステージ, solver) → Histogram
+        self.latency = collections.defaultdict(Histogram)
+        self.counters = collections.Counter()
+        self.last = {}
+
+    def observe_solve(self, solver, info, wall, queue_wait=0.0, cached=False):
+        # info: solve() の result["info"]。キャッシュヒットはサンプリングしていないので件数だけ数える
+        record = {"event": "solve", "ts": time.time(), "solver": solver, "cached": cached, "wall": wall, "queue_wait": queue_wait}
+        if not cached:
+            record.update({"stages": info.get("timings", {}), **{k: info[k] for k in ("bqm_vars", "bqm_interactions", "reads", "unique", "feasible", "orders", "nodes", "pruned") if k in info}})
+        with self.lock:
+            self.counters[("jiro_solves_total", solver, str(cached).lower())] += 1
+            if not cached:
+                for stage, sec in record["stages"].items(): self.latency[(stage, solver)].observe(sec)
+                self.latency[("total", solver)].observe(wall)
+                self.latency[("queue_wait", solver)].observe(queue_wait)
+                for k in ("reads", "unique", "feasible"):
+                    if k in record: self.counters[(f"jiro_samples_{k}_total", solver, None)] += record[k]
+                self.last[solver] = record
+        self._emit(record)
+
+    def observe_render(self, seconds, figures, nbytes):
+        record = {"event": "render", "ts": time.time(), "seconds": seconds, "figures": figures, "bytes": nbytes}
+        with self.lock:
+            self.latency[("render", "app")].observe(seconds)
+            self.counters[("jiro_render_bytes_total", "app", None)] += nbytes
+        self._emit(record)
+
+    def _emit(self, record):
+        self.logger.info(json.dumps(record, ensure_ascii=False))
+        if self.path: self.write(self.path)
+
+    def prometheus_text(self):
+        lines = ["# HELP jiro_stage_seconds Solve path latency per stage", "# TYPE jiro_stage_seconds histogram"]
+        with self.lock:
+            for (stage, solver), h in sorted(self.latency.items()):
+                labels = f'stage="{stage}",solver="{solver}"'
+                cumulative = 0
+                for le, n in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += n
+                    lines.append(f'jiro_stage_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"jiro_stage_seconds_sum{{{labels}}} {h.sum}")
+                lines.append(f"jiro_stage_seconds_count{{{labels}}} {h.count}")
+            for name in sorted({k[0] for k in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (n, solver, cached), v in sorted(self.counters.items(), key=lambda kv: str(kv[0])):
+                    if n != name: continue
+                    labels = f'solver="{solver}"' + (f',cached="{cached}"' if cached is not None else "")
+                    lines.append(f"{name}{{{labels}}} {v}")
+            bqm_sizes = [f'jiro_last_bqm_vars{{solver="{s}"}} {r["bqm_vars"]}' for s, r in sorted(self.last.items()) if "bqm_vars" in r]
+            if bqm_sizes: lines += ["# TYPE jiro_last_bqm_vars gauge"] + bqm_sizes
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        # 読み手が書きかけのファイルを見ないよう、一時ファイルから置き換える
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f: f.write(self.prometheus_text())
+        os.replace(tmp, path)
+
+@functools.lru_cache(maxsize=None)
+def get_metrics():
+    return Metrics()
@@ -0,0 +1,95 @@
+import collections
+import functools
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+
+# セッションをまたいで共有する solve() 結果のキャッシュ
+# スライダーは刻みが粗いので、同じ (重み, リミット, 店舗) の組み合わせが何度も来る
+# JIRO_RESULT_CACHE_PATH を指定するとSQLiteにも書き出して再起動後も使う
+RESULT_CACHE_SIZE = int(os.environ.get("JIRO_RESULT_CACHE_SIZE", 1024))
+RESULT_CACHE_PATH = os.environ.get("JIRO_RESULT_CACHE_PATH")
+
+def result_key(weights, limits, top_k, solver, catalog, solver_opts):
+    # 正規化したキー (浮動小数の表記ゆれ・dictの順序に依存しない)。キャッシュできない引数なら None
+    if any(not isinstance(v, (str, int, float, bool, type(None))) for v in solver_opts.values()): return None
+    canon = (
+        catalog.content_hash, solver, int(top_k),
+        tuple(sorted((k, round(float(v), 6)) for k, v in weights.items())),
+        tuple(sorted((k, round(float(v), 6)) for k, v in limits.items())),
+        tuple(sorted(solver_opts.items())),
+    )
+    return hashlib.sha256(repr(canon).encode()).hexdigest()
+
+class ResultCache:
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, path=RESULT_CACHE_PATH):
+        self.maxsize = maxsize
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.disk_hits = 0
+        self.db = None
+        # メモリでヒットしたキー (ディスクの used は次の書き込みでまとめて更新する)
+        self.touched = set()
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB, used INTEGER)")
+            self.db.commit()
+            self.clock = self.db.execute("SELECT COALESCE(MAX(used), 0) FROM results").fetchone()[0]
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                if self.db is not None: self.touched.add(key)
+                self.hits += 1
+                return self.entries[key]
+            value = self._load(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.hits += 1
+            self._remember(key, value)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self._remember(key, value)
+            self._store(key, value)
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize: self.entries.popitem(last=False)
+
+    def _load(self, key):
+        if self.db is None: return None
+        row = self.db.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        if row is None: return None
+        self.touched.add(key)
+        return pickle.loads(row[0])
+
+    def _store(self, key, value):
+        # ディスク側も同じ件数上限で、最後に使われたのが古いものから消す
+        if self.db is None: return
+        # ヒットした順をメモリのLRU順のまま反映してから書き込む (ヒットのたびにはディスクに書かない)
+        for k in [k for k in self.entries if k in self.touched and k != key]:
+            self.clock += 1
+            self.db.execute("UPDATE results SET used = ? WHERE key = ?", (self.clock, k))
+        self.touched.clear()
+        self.clock += 1
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, pickle.dumps(value), self.clock))
+        self.db.execute("DELETE FROM results WHERE key NOT IN (SELECT key FROM results ORDER BY used DESC LIMIT ?)", (self.maxsize,))
+        self.db.commit()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "disk_hits": self.disk_hits, "hit_rate": self.hits / total if total else 0.0,
+                    "size": len(self.entries), "maxsize": self.maxsize, "persistent": self.db is not None}
+
+@functools.lru_cache(maxsize=None)
+def get_result_cache():
+    return ResultCache()
@@ -0,0 +1,30 @@
+import numpy as np
+
+from catalog import DEFAULT_CATALOG
+from engine import OrderIndex, score_orders, solve_group, weight_keys
+
+WEIGHTS = {k: 1.25 for k in weight_keys}
+
+def test_group_fallback_when_personal_limits_unreachable():
+    # 個人リミットを満たすオーダーが無い人は、超過が最小のオーダーで is_approximate になる
+    group = solve_group([{"name": "x", "weights": WEIGHTS, "limits": {"cal": 100, "sodium": 1.0}}], 1000)
+    diner = group["diners"][0]
+    assert group["is_approximate"] and diner["is_approximate"]
+    assert len(diner["items"]) >= len(DEFAULT_CATALOG.target_categories)
+
+def test_group_fallback_mixed_with_feasible_diner():
+    diners = [{"name": "x", "weights": WEIGHTS, "limits": {"cal": 100, "sodium": 1.0}},
+              {"name": "y", "weights": WEIGHTS, "limits": {"cal": 1800, "sodium": 8.0}}]
+    group = solve_group(diners, 2000)
+    assert [d["is_approximate"] for d in group["diners"]] == [True, False]
+    assert group["total"]["price"] <= 2000
+
+def test_order_index_matches_dense_rows():
+    # 候補番号から出したリソース・スコアが、0/1行列で計算したものと一致する
+    index = OrderIndex(DEFAULT_CATALOG)
+    X = index.rows(np.arange(len(index)))
+    assert len(index) == DEFAULT_CATALOG.order_count() == len({r.tobytes() for r in X})
+    assert ((X @ DEFAULT_CATALOG.category_matrix) == 1).all()
+    assert (index.resources == X @ DEFAULT_CATALOG.resources).all()
+    weights = dict(zip(weight_keys, [0.5, 1.2, 2.0, 0.7, 1.1, 1.9]))
+    assert np.allclose(index.scores(weights), score_orders(X, weights, DEFAULT_CATALOG))
@@ -0,0 +1,28 @@
+from result_cache import ResultCache
+
+def disk_keys(cache):
+    return [r[0] for r in cache.db.execute("SELECT key FROM results ORDER BY used")]
+
+def test_disk_eviction_follows_memory_lru(tmp_path):
+    # 人気のキーへのヒットが続いても、ディスクから他のエントリが消えない
+    cache = ResultCache(maxsize=3, path=str(tmp_path / "results.db"))
+    for k in "abc": cache.put(k, k)
+    for _ in range(5): cache.get("a")
+    cache.put("d", "d")
+    assert list(cache.entries) == ["c", "a", "d"]
+    assert disk_keys(cache) == ["c", "a", "d"]
+
+def test_memory_hit_does_not_write_disk(tmp_path):
+    cache = ResultCache(maxsize=3, path=str(tmp_path / "results.db"))
+    cache.put("a", 1)
+    changes = cache.db.total_changes
+    assert cache.get("a") == 1
+    assert cache.db.total_changes == changes
+
+def test_reload_from_disk(tmp_path):
+    path = str(tmp_path / "results.db")
+    cache = ResultCache(maxsize=2, path=path)
+    for k in "abc": cache.put(k, k.upper())
+    reloaded = ResultCache(maxsize=2, path=path)
+    assert reloaded.get("a") is None and reloaded.get("c") == "C"
+    assert reloaded.stats()["disk_hits"] == 1